@@ -1,5 +1,13 @@
 import os
-from EasySetting.config import Config
+import sys
+
+# The shared helpers are imported from the inputMethod package,
+# it is in the root of the repo
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if _root not in sys.path:
+    sys.path.append(_root)
+
+from EasySetting.config import Config  # noqa: E402
 
 cfg = Config(cfg_path=os.path.join(
     os.path.dirname(__file__),
@@ -0,0 +1,50 @@
+# Json encoder of the responses
+
+# The responses were made by DataFrame.to_json and Series.to_json,
+# the functions make the same json from the plain rows,
+# without building the pandas objects.
+
+# Imports
+from inputMethod.encoder import dumps
+
+
+def frame_dict(rows, columns):
+    '''The dict of the [rows] in the column orient,
+    it is the same as the DataFrame of the [rows] with 0, 1, ... index.
+
+    Args:
+    - @rows: The rows, every row is the tuple of the [columns];
+    - @columns: The names of the columns.
+
+    Outs:
+    - The dict like {column: {index: value}}.
+    '''
+    return {name: {str(j): row[i] for j, row in enumerate(rows)}
+            for i, name in enumerate(columns)}
+
+
+def frame_json(rows, columns):
+    '''The json of the [rows],
+    it is the same as DataFrame(rows, columns=columns).to_json().
+
+    Args:
+    - @rows: The rows, every row is the tuple of the [columns];
+    - @columns: The names of the columns.
+
+    Outs:
+    - The json string.
+    '''
+    return dumps(frame_dict(rows, columns))
+
+
+def series_json(values):
+    '''The json of the [values],
+    it is the same as Series(values).to_json().
+
+    Args:
+    - @values: The list of the values.
+
+    Outs:
+    - The json string.
+    '''
+    return dumps({str(j): e for j, e in enumerate(values)})
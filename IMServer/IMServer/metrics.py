@@ -0,0 +1,42 @@
+# Metrics of the server
+
+# The latency histograms, counters and gauges of the calls,
+# they are reported by the /metrics/ endpoint in the text format,
+# the histograms are the ones of the engine, see inputMethod/metrics.py.
+
+# Imports
+import functools
+import time
+
+from inputMethod.metrics import Metrics
+
+
+def timed(name, size=len):
+    '''Decorate the function to record its calls as [name],
+    the errors are counted as [name]_errors.
+
+    Args:
+    - @name: The name of the calls;
+    - @size: The function of the result giving its size, None refers unknown.
+
+    Outs:
+    - The decorator.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                metrics.count(f'{name}_errors')
+                raise
+            metrics.observe(name, time.perf_counter() - t,
+                            None if size is None else size(result))
+            return result
+        return wrapper
+    return decorator
+
+
+# The metrics of the server
+metrics = Metrics()
@@ -0,0 +1,131 @@
+# Registry of the heavy components
+
+# The components are created on the first use instead of on importing,
+# so the reloads of the dev server and the forks of the workers are fast,
+# the warmup creates them in prior and reports the failures in one place.
+
+# Imports
+import threading
+import time
+
+
+class Registry(object):
+    '''The registry of the lazily created components.
+    '''
+
+    def __init__(self):
+        '''The initialization of the registry.
+        '''
+        self.factories = dict()
+        self.components = dict()
+        self.seconds = dict()
+        self.errors = dict()
+        self.lock = threading.Lock()
+        return
+
+    def register(self, name, factory, warmup=None, required=True):
+        '''Register the component of [name].
+
+        Args:
+        - @name: The name of the component;
+        - @factory: The function creating the component;
+        - @warmup: The function called with the component on warming up,
+                   it pre-touches the indexes, None refers nothing;
+        - @required: Whether the server is not ready without it.
+        '''
+        self.factories[name] = (factory, warmup, required)
+        return
+
+    def get(self, name):
+        '''Get the component of [name], it is created on the first call.
+
+        Args:
+        - @name: The name of the component.
+
+        Outs:
+        - The component.
+        '''
+        if name in self.components:
+            return self.components[name]
+
+        with self.lock:
+            if name not in self.components:
+                factory, _, _ = self.factories[name]
+                t = time.time()
+                try:
+                    component = factory()
+                except Exception as err:
+                    self.errors[name] = repr(err)
+                    raise
+                self.errors.pop(name, None)
+                self.seconds[name] = time.time() - t
+                self.components[name] = component
+        return self.components[name]
+
+    def warmup(self, names=None):
+        '''Create the components and call their warmup functions,
+        the failures are recorded rather than raised, see status.
+
+        Args:
+        - @names: The names of the components, None refers all.
+
+        Outs:
+        - Whether the server is ready, see ready.
+        '''
+        for name in names or list(self.factories):
+            try:
+                component = self.get(name)
+                _, warmup, _ = self.factories[name]
+                if warmup is not None:
+                    t = time.time()
+                    warmup(component)
+                    self.seconds[name] += time.time() - t
+            except Exception as err:
+                self.errors[name] = repr(err)
+        return self.ready()
+
+    def ready(self):
+        '''Whether every required component is created.
+
+        Outs:
+        - True if ready, False if not.
+        '''
+        return all(name in self.components and name not in self.errors
+                   for name, (_, _, required) in self.factories.items()
+                   if required)
+
+    def status(self):
+        '''The status of every component.
+
+        Outs:
+        - The dict of every component and its
+          loaded, required, seconds and error.
+        '''
+        return {name: dict(loaded=name in self.components,
+                           required=required,
+                           seconds=self.seconds.get(name),
+                           error=self.errors.get(name))
+                for name, (_, _, required) in self.factories.items()}
+
+
+def create_worker():
+    from .worker import Worker
+    return Worker()
+
+
+def create_segmenter():
+    from .tools import Segmenter
+    return Segmenter()
+
+
+def create_wechat():
+    from WeChatOperator.script import WeChatOperator
+    return WeChatOperator()
+
+
+registry = Registry()
+registry.register('worker', create_worker, warmup=lambda e: e.warmup())
+registry.register('segmenter', create_segmenter)
+# The WeChatOperator only works on Windows,
+# the input method works without it
+registry.register('wechat', create_wechat, required=False)
@@ -1,9 +1,27 @@
 # Local toolbox
 
+import os
+import json
+import logging
 import jieba
-import pandas as pd
 
+from .metrics import timed
 
+logger = logging.getLogger('IMServer')
+
+# The merged ciZu vocabulary of the input method,
+# and the jieba dictionary built from it, with its prefix dict cache
+_root = os.path.join(os.path.dirname(__file__), '..', '..')
+VOCABULARY_PATH = os.path.join(_root, 'cellDicts', 'merged.json')
+DICTIONARY_PATH = os.path.join(_root, 'jiebaDicts', 'ime_dict.txt')
+CACHE_NAME = 'ime_dict.cache'
+
+# The frequency of the ciZu unknown to jieba,
+# it is high enough to keep the ciZu as a whole word
+USER_FREQ = 100
+
+
+@timed('split_words')
 def split_words(sentence):
     '''Split the [sentence] using jieba.
 
@@ -11,7 +29,105 @@ def split_words(sentence):
     - @sentence: The sentence to split.
 
     Outs:
-    - The Series of splitted words.
+    - The list of splitted words.
+    '''
+    return _split_words(sentence)
+
+
+def _split_words(sentence):
+    # Split without recording the call,
+    # the sentences of split_many are recorded once as the split
+    return [e.strip() for e in jieba.dt.cut(sentence)]
+
+
+def build_dictionary(vocabulary_path=VOCABULARY_PATH,
+                     dictionary_path=DICTIONARY_PATH):
+    '''Build the jieba dictionary with the ciZus in the vocabulary,
+    the ciZus are appended to the default dictionary of jieba,
+    it is skipped if the dictionary is newer than the vocabulary.
+
+    Args:
+    - @vocabulary_path: The merged.json of the input method;
+    - @dictionary_path: The path of the built dictionary.
+
+    Outs:
+    - The path of the dictionary, None if there is no vocabulary.
+    '''
+    if not os.path.isfile(vocabulary_path):
+        logger.warning(f'No vocabulary found in {vocabulary_path}')
+        return None
+    if (os.path.isfile(dictionary_path) and
+            os.path.getmtime(dictionary_path) >
+            os.path.getmtime(vocabulary_path)):
+        return dictionary_path
+
+    # The default dictionary, even if jieba is set to the built one
+    with jieba.Tokenizer().get_dict_file() as f:
+        lines = f.read().decode('utf-8').splitlines()
+    known = set(line.split(' ')[0] for line in lines)
+
+    with open(vocabulary_path, encoding='utf-8') as f:
+        candidates = json.load(f).get('Candidates', {})
+    counts = dict()
+    for cands in candidates.values():
+        for ciZu, count in (cands or {}).items():
+            counts[ciZu] = counts.get(ciZu, 0) + count
+
+    tmp_path = dictionary_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line + '\n')
+        for ciZu, count in counts.items():
+            if ciZu in known or ' ' in ciZu or len(ciZu) == 0:
+                continue
+            f.write(f'{ciZu} {max(count, USER_FREQ)}\n')
+    os.replace(tmp_path, dictionary_path)
+    return dictionary_path
+
+
+class Segmenter(object):
+    '''The jieba segmenter agreeing with the input method.
     '''
-    split = [e.strip() for e in jieba.cut(sentence)]
-    return pd.Series(split)
+
+    def __init__(self, vocabulary_path=VOCABULARY_PATH,
+                 dictionary_path=DICTIONARY_PATH):
+        '''The initialization of the segmenter.
+
+        The jieba model is built from the vocabulary of the input method,
+        the prefix dict is cached next to the dictionary,
+        so the later initializations only load the cache.
+
+        Args:
+        - @vocabulary_path: The merged.json of the input method;
+        - @dictionary_path: The path of the built dictionary.
+        '''
+        path = build_dictionary(vocabulary_path, dictionary_path)
+        if path is not None:
+            jieba.set_dictionary(path)
+            jieba.dt.tmp_dir = os.path.dirname(os.path.abspath(path))
+            jieba.dt.cache_file = CACHE_NAME
+        jieba.initialize()
+        return
+
+    def split(self, sentence):
+        '''Split the [sentence].
+
+        Args:
+        - @sentence: The sentence to split.
+
+        Outs:
+        - The list of splitted words.
+        '''
+        return split_words(sentence)
+
+    @timed('split', size=lambda e: sum(len(words) for words in e))
+    def split_many(self, sentences):
+        '''Split every sentence of the [sentences].
+
+        Args:
+        - @sentences: The list of the sentences to split.
+
+        Outs:
+        - The list of the splitted words of every sentence.
+        '''
+        return [_split_words(e) for e in sentences]
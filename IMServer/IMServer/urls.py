@@ -23,8 +23,11 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     url(r'^$', views.index),
     url(r'^query/(.{1,20})/$', views.query),
+    url(r'^batch/(.{1,600})/$', views.batch),
     url(r'^guess/(.{1,20})/$', views.guess),
-    url(r'^split/(.{1,300})/$', views.split),
+    url(r'^split/([\s\S]{1,3000})/$', views.split),
     url(r'^send/(.{1,300})/$', views.sendMessage),
     url(r'^weChat/(.{1,20})/$', views.wechat),
+    url(r'^ready/$', views.ready),
+    url(r'^metrics/$', views.metrics_text),
 ]
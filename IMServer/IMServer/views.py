@@ -1,49 +1,143 @@
+import logging
 import time
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render
 
-from .worker import worker
-from .tools import split_words
+from .worker import QUERY_COLUMNS, SUGGEST_COLUMNS
+from .encoder import dumps, frame_dict, frame_json, series_json
+from .registry import registry
+from .metrics import metrics, timed
 
-from WeChatOperator.script import WeChatOperator
+# The requests are logged lazily,
+# nothing is formatted unless the debug level is enabled,
+# the latencies of all the requests are in the metrics anyway
+logger = logging.getLogger('IMServer')
 
-wco = WeChatOperator()
 
+def response_size(response):
+    # The size of the response in bytes
+    return len(response.content)
 
+
+# The max number of the found slices of a query,
+# it bounds the response of the broad queries like "s",
+# the client may ask for more with the limit and offset parameters
+QUERY_LIMIT = 100
+
+
+def number(request, name, default):
+    # The GET parameter [name] as the non-negative integer,
+    # [default] if it is missing,
+    # raise ValueError if it is not a non-negative integer
+    value = request.GET.get(name)
+    if value is None:
+        return default
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(f'{name} should be a non-negative integer, '
+                         f'got {value!r}')
+    return int(value)
+
+
+def page(request):
+    # The limit, offset and cap of the query in the GET parameters,
+    # raise ValueError if any of them is invalid
+    return dict(
+        limit=number(request, 'limit', QUERY_LIMIT),
+        offset=number(request, 'offset', 0),
+        cap=number(request, 'cap', None),
+    )
+
+
+def bad_request(error):
+    # The response of the invalid request
+    return HttpResponseBadRequest(dumps(dict(error=str(error))),
+                                  content_type='application/json')
+
+
+@timed('view_index', size=None)
 def index(request):
-    print(request)
+    logger.debug('%s', request)
     contents = dict(
         currentTime=time.ctime()
     )
     return render(request, 'BCIScreen.html', contents)
 
 
+@timed('view_query', size=response_size)
 def query(request, pinYin):
-    print(request, pinYin)
-    found = worker.query(pinYin)
-    return HttpResponse(found.to_json(), content_type='application/json')
+    logger.debug('%s %s', request, pinYin)
+    try:
+        options = page(request)
+    except ValueError as error:
+        return bad_request(error)
+    found = registry.get('worker').query(pinYin, **options)
+    return HttpResponse(frame_json(found, QUERY_COLUMNS),
+                        content_type='application/json')
+
+
+@timed('view_batch', size=response_size)
+def batch(request, pinYins):
+    # The [pinYins] are separated by ','
+    logger.debug('%s %s', request, pinYins)
+    try:
+        options = page(request)
+    except ValueError as error:
+        return bad_request(error)
+    founds = registry.get('worker').batch_query(pinYins.split(','),
+                                                **options)
+    content = dumps({pinYin: frame_dict(found, QUERY_COLUMNS)
+                     for pinYin, found in founds.items()})
+    return HttpResponse(content, content_type='application/json')
 
 
+@timed('view_guess', size=response_size)
 def guess(request, zi):
-    print(request, zi)
-    found = worker.suggest(zi)
-    return HttpResponse(found.to_json(), content_type='application/json')
+    logger.debug('%s %s', request, zi)
+    found = registry.get('worker').suggest(zi)
+    return HttpResponse(frame_json(found, SUGGEST_COLUMNS),
+                        content_type='application/json')
 
 
+@timed('view_split', size=response_size)
 def split(request, sentence):
-    print(request, sentence)
-    split = split_words(sentence)
-    return HttpResponse(split.to_json(), content_type='application/json')
+    # The sentences are separated by '\n',
+    # the words of one sentence are returned as it was,
+    # the list of them is returned for several sentences
+    logger.debug('%s %s', request, sentence)
+    sentences = sentence.split('\n')
+    splits = registry.get('segmenter').split_many(sentences)
+    if len(splits) == 1:
+        content = series_json(splits[0])
+    else:
+        content = '[' + ','.join(series_json(e) for e in splits) + ']'
+    return HttpResponse(content, content_type='application/json')
+
+
+def metrics_text(request):
+    # The metrics in the text format, see metrics
+    return HttpResponse(metrics.render('imserver_'),
+                        content_type='text/plain; charset=utf-8')
+
+
+def ready(request):
+    # The status of the components, see registry
+    logger.debug('%s', request)
+    ready = registry.ready()
+    content = dumps(dict(ready=ready, components=registry.status()))
+    return HttpResponse(content, content_type='application/json',
+                        status=200 if ready else 503)
 
 
+@timed('view_send', size=None)
 def sendMessage(request, message):
-    print(request, message)
-    wco.write_message(message)
+    logger.debug('%s %s', request, message)
+    registry.get('wechat').write_message(message)
     return HttpResponse('{"state": "OK"}', content_type='application/json')
 
 
+@timed('view_wechat', size=None)
 def wechat(request, command):
-    print(request, command)
+    logger.debug('%s %s', request, command)
     if command == 'display':
-        wco.display_wechat()
+        registry.get('wechat').display_wechat()
     return HttpResponse('{"state": "OK"}', content_type='application/json')
@@ -6,11 +6,18 @@
 
 # Imports
 import os
-import re
 import json
+import functools
+import numpy as np
 import pandas as pd
 
 from . import cfg
+from .metrics import metrics, timed
+
+# The columns of the found rows,
+# every row of the query and suggest is the tuple of the columns
+QUERY_COLUMNS = ['pinYin', 'ciZus', 'count']
+SUGGEST_COLUMNS = ['ciZu', 'pinYin', 'suggests']
 
 
 def match(r, string):
@@ -27,6 +34,115 @@ def match(r, string):
     return r.match(string) is not None
 
 
+def is_subsequence(pattern, string):
+    '''
+    Whether the [pattern] is a subsequence of the [string],
+    for example, "abc" is a subsequence of "axxbyczz".
+
+    Args:
+    - @pattern: The letters to be found in order;
+    - @string: The string to be tested.
+
+    Out:
+    - True if it is, False if not
+    '''
+    it = iter(string)
+    return all(c in it for c in pattern)
+
+
+class SubsequenceIndex(object):
+    '''The index of the strings for the vague matching,
+    the [query] matches the string starting with query[0],
+    and having the rest letters of the query in order.
+
+    The index is the inverted index of the letters,
+    the rows of the strings starting with every letter,
+    and the rows of the strings containing every letter,
+    are stored as boolean masks.
+    The masks of the query letters narrow the candidates,
+    and only the remaining candidates are checked in order.
+    The matches of a query are a subset of the matches of its prefix,
+    so the query typed letter by letter reuses the cached matches.
+    '''
+
+    def __init__(self, strings, cache_size=4096):
+        '''The initialization of the index.
+
+        Args:
+        - @strings: The strings to be indexed, their order is kept;
+        - @cache_size: The max number of the cached queries.
+        '''
+        self.strings = [str(e) for e in strings]
+        size = len(self.strings)
+
+        first = dict()
+        contains = dict()
+        for j, string in enumerate(self.strings):
+            if len(string) == 0:
+                continue
+            first.setdefault(string[0], []).append(j)
+            for c in set(string):
+                contains.setdefault(c, []).append(j)
+
+        def mask(rows):
+            m = np.zeros(size, dtype=bool)
+            m[rows] = True
+            return m
+
+        self.first = {c: mask(rows) for c, rows in first.items()}
+        self.contains = {c: mask(rows) for c, rows in contains.items()}
+        self.match = functools.lru_cache(maxsize=cache_size)(self._match)
+        return
+
+    def __len__(self):
+        return len(self.strings)
+
+    def _match(self, query):
+        '''The rows of the strings matching with the [query],
+        use the cached self.match instead,
+        the returned array is shared and should not be changed.
+
+        Args:
+        - @query: The letters to be matched.
+
+        Outs:
+        - The array of the matched rows in the ascending order.
+        '''
+        if len(query) == 0 or query[0] not in self.first:
+            return np.zeros(0, dtype=int)
+
+        if len(query) > 2:
+            # Narrow the matches of the prefix
+            c = query[-1]
+            if c not in self.contains:
+                return np.zeros(0, dtype=int)
+            rows = self.match(query[:-1])
+            rows = rows[self.contains[c][rows]]
+            rest = query[1:]
+            strings = self.strings
+            return np.array([j for j in rows
+                             if is_subsequence(rest, strings[j][1:])],
+                            dtype=int)
+
+        mask = self.first[query[0]]
+        for c in set(query[1:]):
+            if c not in self.contains:
+                return np.zeros(0, dtype=int)
+            mask = mask & self.contains[c]
+        rows = np.flatnonzero(mask)
+
+        # The masks ignore the repeats of the letters,
+        # they are enough for the query of distinct letters
+        if query[:1] == query[1:]:
+            rest = query[1:]
+            strings = self.strings
+            rows = np.array([j for j in rows
+                             if is_subsequence(rest, strings[j][1:])],
+                            dtype=int)
+
+        return rows
+
+
 def regular(df, columns):
     '''Regular the [df],
     the [columns] will be selected,
@@ -43,6 +159,20 @@ def regular(df, columns):
     return df[columns]
 
 
+def table_rows(df, columns):
+    '''The rows of the [columns] in the [df] as python tuples,
+    the numpy scalars are converted into python ones.
+
+    Args:
+    - @df: The DataFrame to be converted;
+    - @columns: The columns of the rows.
+
+    Outs:
+    - The list of the rows.
+    '''
+    return list(zip(*[df[c].tolist() for c in columns]))
+
+
 class Worker(object):
     '''The backend worker of the input method.
     '''
@@ -56,38 +186,88 @@ class Worker(object):
         Args:
         - @ cfg: The config object, default value is cfg in prior.
         '''
-        self.pinYin_table = pd.read_json(cfg.get('pinYinTable', 'Path'))
+        # The pinYin_table is ranked by the count,
+        # so the found slices are ranked
+        pinYin_table = pd.read_json(cfg.get('pinYinTable', 'Path'))
+        self.pinYin_table = regular(
+            pinYin_table.sort_values('count', ascending=False,
+                                     kind='mergesort'),
+            pinYin_table.columns)
+        self.pinYin_index = SubsequenceIndex(self.pinYin_table['pinYin'])
+        self.pinYin_rows = table_rows(self.pinYin_table, QUERY_COLUMNS)
+
+        # The rows of every ciZu in the ciZu_table,
+        # so the suggests of a ciZu is fetched by hashing
         self.ciZu_table = pd.read_json(cfg.get('ciZuTable', 'Path'))
+        self.ciZu_rows = dict()
+        for row in table_rows(self.ciZu_table, SUGGEST_COLUMNS):
+            self.ciZu_rows.setdefault(row[0], []).append(row)
+
+        metrics.gauge('query_cache_hit_rate', self.cache_hit_rate)
         return
 
-    def query(self, pinYin):
+    def cache_hit_rate(self):
+        '''The hit rate of the cached matches of the queries.
+        '''
+        info = self.pinYin_index.match.cache_info()
+        total = info.hits + info.misses
+        return info.hits / total if total else 0.0
+
+    @timed('query')
+    def query(self, pinYin, limit=None, offset=0, cap=None):
         '''Query the ciZu of the[pinYin],
         the vague matching method is used,
         for example, "abc" matches with the patterns like "axxbyczz".
 
+        The matches are ranked when the table is loaded,
+        so the page of them is a slice.
+
         Args:
-        - @pinYin: The pinYin string to be queried.
+        - @pinYin: The pinYin string to be queried;
+        - @limit: The max number of the found slices, None refers all;
+        - @offset: The number of the found slices to be skipped;
+        - @cap: The max number of the ciZus of every slice, None refers all.
 
         Outs:
-        - @ciZu_json: The found slices.
+        - @found: The list of the found rows, ranked by the count,
+                  every row is the tuple of QUERY_COLUMNS.
         '''
+        return self._query(pinYin, limit, offset, cap)
 
-        columns = ['pinYin', 'ciZus', 'count']
+    def _query(self, pinYin, limit=None, offset=0, cap=None):
+        # The query without recording the call,
+        # the queries of the batch are recorded once as the batch_query
+        rows = self.pinYin_index.match(pinYin)
+        end = None if limit is None else offset + limit
+        found = [self.pinYin_rows[j] for j in rows[offset:end]]
 
-        p = '.*'.join(pinYin)
-        p = p + '.*'
-        r = re.compile(p)
+        if cap is not None:
+            found = [(pinYin, ciZus[:cap], count)
+                     for pinYin, ciZus, count in found]
 
-        # found = self.pinYin_table[self.pinYin_table['pinYin'].map(
-        #     lambda e: match(r, e))]
+        return found
 
-        found = self.pinYin_table[self.pinYin_table['pinYin'].map(
-            lambda e: e.startswith(p[0]))]
-        if len(found) > 0:
-            found = found[found['pinYin'].map(lambda e: match(r, e))]
+    @timed('batch_query')
+    def batch_query(self, pinYins, **page):
+        '''Query the ciZu of every pinYin in the [pinYins],
+        the queries are made from the shorter to the longer ones,
+        so the longer ones narrow the cached matches of their prefixes,
+        it fits the next inputs of a screen, like the buffer and its
+        extensions by every letter.
 
-        return regular(found, columns)
+        Args:
+        - @pinYins: The pinYin strings to be queried;
+        - @page: The limit, offset and cap of every query, see query.
 
+        Outs:
+        - @founds: The dict of every pinYin and its found rows.
+        '''
+        founds = dict()
+        for pinYin in sorted(set(pinYins), key=len):
+            founds[pinYin] = self._query(pinYin, **page)
+        return founds
+
+    @timed('suggest')
     def suggest(self, ciZu):
         '''Check out some suggestion of the[ciZu] input.
 
@@ -95,13 +275,16 @@ class Worker(object):
         - @ciZu: The ciZu of being checked.
 
         Outs:
-        - @suggest_json: The slices of suggestions.
+        - @found: The list of the rows of suggestions,
+                  every row is the tuple of SUGGEST_COLUMNS.
         '''
-        columns = ['ciZu', 'pinYin', 'suggests']
-
-        found = self.ciZu_table.query(f'ciZu == "{ciZu}"')
-
-        return regular(found, columns)
+        return self.ciZu_rows.get(ciZu, [])
 
-
-worker = Worker()
+    def warmup(self):
+        '''Pre-touch the indexes,
+        the queries of the single letters are cached,
+        since they are the first keystrokes.
+        '''
+        for c in self.pinYin_index.first:
+            self.pinYin_index.match(c)
+        return
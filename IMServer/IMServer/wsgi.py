@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'IMServer.settings')
 
 application = get_wsgi_application()
+
+# Create the components before serving,
+# the failures are reported by the /ready/ endpoint
+from .registry import registry  # noqa: E402
+
+registry.warmup()
@@ -0,0 +1,62 @@
+'''
+Micro-benchmark of the json serialization of the views.
+
+The views used to slice the DataFrame and serialize it with to_json,
+they serialize the plain rows with IMServer.encoder now.
+'''
+
+# %%
+import random
+import timeit
+import pandas as pd
+from IMServer.encoder import frame_json
+from IMServer.worker import QUERY_COLUMNS, regular, table_rows
+
+# %%
+# How many rows in the table and the repeats of every measurement
+num = 10000
+repeat = 1000
+
+# %%
+# Generate the table like the pinYin table
+random.seed(0)
+chars = [chr(ord('a') + j) for j in range(26)]
+words = [chr(0x4e00 + j) * 2 for j in range(1000)]
+
+table = pd.DataFrame(dict(
+    pinYin=[''.join(random.choices(chars, k=random.randint(2, 8)))
+            for _ in range(num)],
+    ciZus=[random.sample(words, random.randint(1, 20)) for _ in range(num)],
+    count=[random.randint(0, 1000) for _ in range(num)],
+))
+rows = table_rows(table, QUERY_COLUMNS)
+
+
+# %%
+def before(found):
+    # Slice the DataFrame and serialize it
+    return regular(table.iloc[found], QUERY_COLUMNS).to_json()
+
+
+def after(found):
+    # Slice the rows and serialize them
+    return frame_json([rows[j] for j in found], QUERY_COLUMNS)
+
+
+# %%
+report = []
+for size in [0, 1, 10, 100]:
+    found = sorted(random.sample(range(num), size))
+    assert(before(found) == after(found))
+    costs = dict(
+        (name, min(timeit.repeat(lambda: func(found),
+                                 number=repeat, repeat=3)) / repeat * 1e6)
+        for name, func in [('Before', before), ('After', after)])
+    report.append(dict(Rows=size, **costs))
+
+report = pd.DataFrame(report)
+report['Speedup'] = report['Before'] / report['After']
+
+# %%
+print('Latency of the serialization per request (us)')
+print(report.to_string(index=False))
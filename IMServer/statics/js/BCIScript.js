@@ -77,35 +77,66 @@ function ravel(table) {
     return lst;
 }
 
+// Query results of the next inputs,
+// they are fetched in one batch when the screen changes
+let prefetched = {};
+
+function prefetch(value) {
+    // Fetch the next inputs of [value],
+    // the [value] extended by every selectable letter
+    let fragments = [];
+    for (let i = 97; i < 97 + 26; i++) {
+        fragments.push(value + String.fromCharCode(i));
+    }
+
+    d3.json("batch/" + fragments.join(",")).then(function(json) {
+        prefetched = json;
+    });
+}
+
 function newInput() {
     // Operation on new input
     let inp = get("main-input");
-    let out = get("main-output");
     let value = inp.value;
-    let panel = d3.select("#dynamic-1-panel");
 
-    d3.json("query/" + value).then(function(json) {
-        clearAll(panel, "div");
-        let lst = ravel(json.ciZus);
+    if (value in prefetched) {
+        showInput(prefetched[value]);
+        prefetch(value);
+        return;
+    }
 
-        panel
-            .append("div")
-            .attr("class", "flex")
-            .selectAll("p")
-            .data(lst)
-            .enter()
-            .append("p")
-            .text((d) => d)
-            .attr("class", "clickable")
-            .on("click", function(e, d) {
-                console.log(d);
-                out.value += d;
-                inp.value = "";
-                newSuggest(d);
-            });
+    d3.json("query/" + value).then(function(json) {
+        showInput(json);
+        prefetch(value);
     });
 }
 
+function showInput(json) {
+    // Show the ciZus of the queried [json]
+    let inp = get("main-input");
+    let out = get("main-output");
+    let panel = d3.select("#dynamic-1-panel");
+
+    clearAll(panel, "div");
+    let lst = ravel(json.ciZus);
+
+    panel
+        .append("div")
+        .attr("class", "flex")
+        .selectAll("p")
+        .data(lst)
+        .enter()
+        .append("p")
+        .text((d) => d)
+        .attr("class", "clickable")
+        .on("click", function(e, d) {
+            console.log(d);
+            out.value += d;
+            inp.value = "";
+            newSuggest(d);
+        });
+}
+
 function newSuggest(ciZu) {
     // Fetch suggestions based on ciZu
     let out = get("main-output");
@@ -0,0 +1,405 @@
+# File: speed_suite.py
+# Aim: Benchmark the input method with realistic typing sessions
+
+'''
+Benchmark the latencies of the input method.
+
+The workload is the real pinYin typed letter by letter,
+the words of the corpus are split by jieba and converted by pypinyin,
+like jiebaDicts/fenci_demo.py,
+without the corpus, the pinYins are drawn from the dict by their counts.
+
+Every typed word is replayed keystroke by keystroke through
+- checkout: PinYinEngine.checkout of every prefix;
+- session: CheckoutSession of the engine, one letter at a time;
+- query: Worker.query of IMServer of every prefix;
+- suggest: Worker.suggest of IMServer of the found ciZus;
+- parse: SCEL_cellDict of parseSogou_cellDict over the .scel files.
+
+The p50, p95, p99 and the throughput are reported,
+and written into the json file, the files of two runs can be compared.
+
+Usage:
+    python benchmarks/speed_suite.py [--corpus material.txt] [-o out.json]
+    python benchmarks/speed_suite.py --compare old.json new.json
+'''
+
+# %%
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for path in [_root,
+             os.path.join(_root, 'IMServer'),
+             os.path.join(_root, 'parseSogou_cellDict')]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+# The folder of the results
+RESULTS_DIR = os.path.join(_root, 'benchmarks', 'results')
+
+# The page size of the query, as the views of IMServer
+QUERY_LIMIT = 100
+
+# The benchmarks in the order of running
+BENCHMARKS = ['checkout', 'session', 'query', 'suggest', 'parse']
+
+# Percentiles in the report
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# %%
+def percentile(values, q):
+    '''The [q] percentile of the sorted [values], by the nearest rank.
+    '''
+    if len(values) == 0:
+        return 0
+    rank = max(int(-(-q * len(values) // 1)), 1)
+    return values[rank - 1]
+
+
+def summarize(seconds, sizes):
+    '''Summarize the latencies of the calls.
+
+    Args:
+    - @seconds: The latency of every call;
+    - @sizes: The result size of every call.
+
+    Outs:
+    - The dict of the calls, throughput, mean, max, the percentiles
+      and the mean size of the results, the latencies are in seconds.
+    '''
+    values = sorted(seconds)
+    total = sum(values)
+    summary = dict(calls=len(values),
+                   seconds=total,
+                   throughput=len(values) / total if total else 0,
+                   mean=total / len(values) if values else 0,
+                   max=values[-1] if values else 0)
+    for q in QUANTILES:
+        summary[f'p{round(q * 100)}'] = percentile(values, q)
+    summary['size'] = sum(sizes) / len(sizes) if sizes else 0
+    return summary
+
+
+def replay(func, inputs, size=len):
+    '''Call [func] with every input and record the latencies.
+
+    Args:
+    - @func: The function of the benchmark;
+    - @inputs: The inputs of the calls;
+    - @size: The function of the result giving its size.
+
+    Outs:
+    - The summary of the calls, see summarize.
+    '''
+    seconds = []
+    sizes = []
+    for inp in inputs:
+        t = time.perf_counter()
+        result = func(inp)
+        seconds.append(time.perf_counter() - t)
+        sizes.append(size(result))
+    return summarize(seconds, sizes)
+
+
+def keystrokes(words):
+    '''Every prefix of every word, in the order of typing.
+    '''
+    return [word[:j] for word in words for j in range(1, len(word) + 1)]
+
+
+# %%
+def corpus_words(path):
+    '''The pinYins of the words in the corpus,
+    the words are split by jieba and converted by pypinyin.
+
+    Args:
+    - @path: The path of the corpus in utf-8.
+
+    Outs:
+    - The list of the pinYins in the order of the corpus.
+    '''
+    import jieba
+    from pypinyin import lazy_pinyin
+
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+
+    pinYins = []
+    for word in jieba.cut(text):
+        word = word.strip()
+        if not word:
+            continue
+        pinYin = ''.join(lazy_pinyin(word)).lower()
+        if pinYin.isascii() and pinYin.isalpha():
+            pinYins.append(pinYin)
+    return pinYins
+
+
+def dict_words(path, num, rng):
+    '''The pinYins drawn from the dict by their counts.
+
+    Args:
+    - @path: The merged.json of the dict;
+    - @num: The number of the pinYins;
+    - @rng: The random generator.
+
+    Outs:
+    - The list of the pinYins.
+    '''
+    with open(path, encoding='utf-8') as f:
+        counts = json.load(f)['Count']
+    pinYins = [e for e in counts if e.isascii() and e.isalpha()]
+    weights = [max(counts[e], 1) for e in pinYins]
+    return rng.choices(pinYins, weights=weights, k=num)
+
+
+def workload(args):
+    '''The typed words of the benchmark.
+
+    Outs:
+    - The list of the words and the description of the workload.
+    '''
+    rng = random.Random(args.seed)
+    if args.corpus is not None:
+        words = corpus_words(args.corpus)
+        source = os.path.basename(args.corpus)
+        if len(words) > args.words:
+            start = rng.randrange(len(words) - args.words + 1)
+            words = words[start:start + args.words]
+    else:
+        from inputMethod import _cellDict_path
+        words = dict_words(_cellDict_path, args.words, rng)
+        source = 'dict'
+    return words, dict(source=source,
+                       seed=args.seed,
+                       words=len(words),
+                       keystrokes=sum(len(e) for e in words))
+
+
+# %%
+def bench_engine(words, args):
+    '''Benchmark the checkout and the session of the PinYinEngine.
+    '''
+    from inputMethod import _cellDict_path, _compiled_path
+    from inputMethod.compiled_dict import dict_path
+    from inputMethod.pinYin_engine import PinYinEngine
+
+    path = dict_path(_compiled_path, _cellDict_path)
+    engine = PinYinEngine(path, tree_backend=args.backend)
+    results = dict()
+    if 'checkout' in args.only:
+        results['checkout'] = replay(
+            lambda e: engine.checkout(e, return_frame=False),
+            keystrokes(words))
+
+    if 'session' in args.only:
+        # Every keystroke appends one letter to the session
+        session = engine.session()
+        seconds = []
+        sizes = []
+        for word in words:
+            session.set('')
+            for c in word:
+                t = time.perf_counter()
+                session.append(c)
+                found = session.checkout(return_frame=False)
+                seconds.append(time.perf_counter() - t)
+                sizes.append(len(found))
+        results['session'] = summarize(seconds, sizes)
+    return results
+
+
+def bench_worker(words, args):
+    '''Benchmark the query and the suggest of the Worker of IMServer.
+    '''
+    from IMServer.registry import registry
+
+    worker = registry.get('worker')
+    results = dict()
+    if 'query' in args.only:
+        results['query'] = replay(
+            lambda e: worker.query(e, limit=QUERY_LIMIT), keystrokes(words))
+
+    if 'suggest' in args.only:
+        # The ciZus picked after typing the whole words
+        ciZus = []
+        for word in words:
+            for _, czs, _ in worker.query(word, limit=1):
+                ciZus.extend(czs[:1])
+        results['suggest'] = replay(worker.suggest, ciZus)
+    return results
+
+
+def bench_parser(args):
+    '''Benchmark the parsing of the .scel files.
+    '''
+    from parse_cellDict import SCEL_cellDict
+
+    paths = sorted(args.scel or
+                   glob.glob(os.path.join(_root, 'cellDicts', '*.scel')))
+    if len(paths) == 0:
+        raise FileNotFoundError('No .scel files found')
+
+    def parse(path):
+        # Parse the [path] with the empty counts
+        celldict = SCEL_cellDict(path, dict())
+        celldict.pipeline()
+        return celldict.words
+
+    return dict(parse=replay(parse, paths * args.repeat))
+
+
+def run(args):
+    '''Run the benchmarks and write the results.
+    '''
+    words, description = workload(args)
+    print(f'Workload: {description}')
+
+    results = dict()
+    skipped = dict()
+    groups = [(['checkout', 'session'], lambda: bench_engine(words, args)),
+              (['query', 'suggest'], lambda: bench_worker(words, args)),
+              (['parse'], lambda: bench_parser(args))]
+    for names, bench in groups:
+        names = [e for e in names if e in args.only]
+        if not names:
+            continue
+        try:
+            results.update(bench())
+        except Exception as err:
+            # The missing data, packages or settings skip the benchmarks,
+            # the results of the others are still written
+            for name in names:
+                skipped[name] = repr(err)
+            print(f'Skip {", ".join(names)}: {err!r}')
+
+    report = dict(created=datetime.datetime.now().isoformat(),
+                  python=platform.python_version(),
+                  platform=platform.platform(),
+                  workload=description,
+                  results=results,
+                  skipped=skipped)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'speed-{stamp}.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print_results(results)
+    print(f'Results are written into {output}')
+    return 0
+
+
+# %%
+def print_results(results):
+    '''Print the results in the table, the latencies are in microseconds.
+    '''
+    print(f'{"Name":10}{"Calls":>8}{"p50":>10}{"p95":>10}{"p99":>10}'
+          f'{"Max":>10}{"Calls/s":>12}{"Size":>8}')
+    for name, e in results.items():
+        print(f'{name:10}{e["calls"]:8d}'
+              f'{e["p50"] * 1e6:10.1f}{e["p95"] * 1e6:10.1f}'
+              f'{e["p99"] * 1e6:10.1f}{e["max"] * 1e6:10.1f}'
+              f'{e["throughput"]:12.1f}{e["size"]:8.1f}')
+
+
+def compare(old_path, new_path, threshold):
+    '''Compare the results of two runs.
+
+    Args:
+    - @old_path: The results of the old run;
+    - @new_path: The results of the new run;
+    - @threshold: The relative change taken as the regression.
+
+    Outs:
+    - 1 if any benchmark regresses, 0 if not.
+    '''
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    if not old['workload'] == new['workload']:
+        print(f'Warning: the workloads differ,\n'
+              f'  {old["workload"]}\n  {new["workload"]}')
+
+    metrics = [f'p{round(q * 100)}' for q in QUANTILES] + ['throughput']
+    print(f'{"Name":10}{"Metric":>12}{"Old":>12}{"New":>12}{"Change":>10}')
+    regressed = []
+    for name, e in new['results'].items():
+        if name not in old['results']:
+            continue
+        for metric in metrics:
+            before = old['results'][name][metric]
+            after = e[metric]
+            change = (after - before) / before if before else 0
+            # The latencies regress on growing,
+            # the throughput regresses on dropping
+            worse = -change if metric == 'throughput' else change
+            flag = ''
+            if worse > threshold:
+                flag = ' !'
+                regressed.append(f'{name} {metric}')
+            scale = 1 if metric == 'throughput' else 1e6
+            print(f'{name:10}{metric:>12}{before * scale:12.1f}'
+                  f'{after * scale:12.1f}{change:+10.1%}{flag}')
+
+    if regressed:
+        print(f'Regressed by more than {threshold:.0%}: '
+              f'{", ".join(regressed)}')
+        return 1
+    return 0
+
+
+# %%
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the input method with typing sessions.')
+    parser.add_argument('--corpus',
+                        help='The corpus in utf-8, '
+                             'the pinYins are drawn from the dict without it')
+    parser.add_argument('--words', type=int, default=500,
+                        help='The number of the typed words')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of drawing the words')
+    parser.add_argument('--backend', default='dict',
+                        help='The tree backend of the engine')
+    parser.add_argument('--scel', nargs='*',
+                        help='The .scel files to parse, '
+                             'default is the ones in cellDicts')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The repeats of parsing every .scel file')
+    parser.add_argument('--only', default=','.join(BENCHMARKS),
+                        help='The benchmarks to run, separated by ","')
+    parser.add_argument('-o', '--output',
+                        help='The json file of the results')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='Compare the results of two runs')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='The relative change taken as the regression')
+    args = parser.parse_args(argv)
+    args.only = args.only.split(',')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare is not None:
+        return compare(*args.compare, args.threshold)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
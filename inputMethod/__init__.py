@@ -8,3 +8,6 @@ import os
 _cellDict_dir = os.path.join(os.path.dirname(__file__), '..', 'cellDicts')
 
 _cellDict_path = os.path.join(_cellDict_dir, 'merged.json')
+
+# Compiled merged.json, see compiled_dict.py
+_compiled_path = os.path.join(_cellDict_dir, 'merged.bin')
@@ -0,0 +1,378 @@
+# File: compact_tree.py
+# Package: inputMethod
+# Aim: Provide array-backed pinYin tree with the same interface as PinYinTree
+
+import bisect
+import logging
+import time
+from array import array
+from collections import deque
+
+from .tree_walk import MAX_SOURCES, path_founds, walk_path
+
+logger = logging.getLogger('Engine')
+
+# Name and typecode of the node arrays
+NODE_ARRAYS = [('labels', 'H'), ('first', 'i'), ('degree', 'H'),
+               ('ends', 'i'), ('masks', 'B'), ('end_masks', 'B')]
+
+
+class CompactPinYinTree(object):
+    # PinYin tree stored in flat typed arrays, LOUDS-like layout.
+    # Every node is an integer, the root is the node 0,
+    # the children of a node are stored contiguously and sorted by label,
+    # so a node costs a dozen bytes instead of a whole python dict:
+    #   labels[n]: ord of the letter leading to the node n,
+    #   first[n]: the first child of the node n,
+    #   degree[n]: the number of the children of the node n,
+    #   ends[n]: index of the pinYin ending at n in self.keys, -1 if none,
+    #   masks[n]: bit mask of the sources having pinYins under the node n,
+    #   end_masks[n]: bit mask of the sources having the pinYin ending at n.
+    # Every source has its own counts and top-k arrays:
+    #   counts[s][j]: count of the pinYin self.keys[j] in the source s,
+    #   tops[s][n * top_k:(n + 1) * top_k]: indexes of the top-k most frequent
+    #                                       pinYins of the source s under
+    #                                       the node n, -1 padded.
+    def __init__(self, top_k=3):
+        self.top_k = top_k
+        self.keys = []
+        self.labels = array('H', [0])
+        self.first = array('i', [1])
+        self.degree = array('H', [0])
+        self.ends = array('i', [-1])
+        self.masks = array('B', [0])
+        self.end_masks = array('B', [0])
+        self.counts = []
+        self.tops = []
+        self.count_totals = []
+        self.root = 0
+        self.frozen = False
+        logger.debug('Compact tree initalized')
+
+    @classmethod
+    def from_arrays(cls, keys, labels, first, degree, ends, masks, end_masks,
+                    counts, tops, top_k=3):
+        # Create the tree on existing arrays,
+        # they are read-only sequences like memoryview of the compiled file,
+        # [counts] and [tops] are the lists of the arrays of every source,
+        # the tree is frozen until it is changed
+        tree = cls(top_k=top_k)
+        tree.keys = keys
+        tree.labels = labels
+        tree.first = first
+        tree.degree = degree
+        tree.ends = ends
+        tree.masks = masks
+        tree.end_masks = end_masks
+        tree.counts = list(counts)
+        tree.tops = list(tops)
+        # The totals are summed on the first call of total
+        tree.count_totals = [None for _ in counts]
+        tree.frozen = True
+        return tree
+
+    def _thaw(self):
+        # Copy the read-only arrays into the typed arrays,
+        # it is required before changing the frozen tree
+        if not self.frozen:
+            return
+
+        def copy(code, values):
+            copied = array(code)
+            copied.frombytes(memoryview(values).cast('B'))
+            return copied
+
+        for name, code in NODE_ARRAYS:
+            setattr(self, name, copy(code, getattr(self, name)))
+        self.counts = [copy('q', e) for e in self.counts]
+        self.tops = [copy('i', e) for e in self.tops]
+        self.keys = list(self.keys)
+        self.frozen = False
+
+    def _source(self, source):
+        # Make sure the arrays of the [source] are ready
+        if not 0 <= source < MAX_SOURCES:
+            raise ValueError(f'The source should be in [0, {MAX_SOURCES})')
+        while len(self.counts) <= source:
+            self.counts.append(array('q', [0]) * len(self.keys))
+            self.tops.append(array('i', [-1]) * (len(self.labels) * self.top_k))
+            self.count_totals.append(0)
+
+    def __len__(self):
+        # Number of the nodes
+        return len(self.labels)
+
+    def nbytes(self):
+        # Memory used by the node arrays
+        arrays = [getattr(self, name) for name, _ in NODE_ARRAYS]
+        return sum(e.itemsize * len(e)
+                   for e in arrays + self.counts + self.tops)
+
+    def source_counts(self, source):
+        # Dict of the pinYins of the [source] and their counts
+        bit = 1 << source
+        return {self.keys[self.ends[node]]: self.counts[source][self.ends[node]]
+                for node in range(len(self.labels))
+                if self.ends[node] >= 0 and self.end_masks[node] & bit}
+
+    def generate(self, frame, source=0):
+        # Generate based on [frame] as the [source],
+        # the tree is rebuilt in breadth-first order from the sorted pinYins,
+        # existing pinYins are kept
+        t = time.time()
+        self._source(source)
+        counts = [self.source_counts(s) for s in range(len(self.counts))]
+        for pinYin in frame.index:
+            counts[source].setdefault(pinYin, 0)
+        if 'Count' in frame.columns:
+            counts[source].update(frame.Count.to_dict())
+        self._build(counts)
+        logger.debug('Compact tree generation used {} seconds'.format(
+            time.time() - t))
+
+    def _build(self, counts):
+        # Build the arrays from scratch using [counts],
+        # it is the list of the dicts of pinYin and its count of every source
+        keys = sorted(set().union(*counts))
+        labels = array('H', [0])
+        first = array('i', [0])
+        degree = array('H', [0])
+        ends = array('i', [-1])
+
+        # Every item is (node, lo, hi, depth),
+        # keys[lo:hi] are the pinYins under the node,
+        # they share the first [depth] letters
+        queue = deque([(0, 0, len(keys), 0)])
+        while queue:
+            node, lo, hi, depth = queue.popleft()
+            # The pinYin ending at the node is sorted in the first place
+            if lo < hi and len(keys[lo]) == depth:
+                ends[node] = lo
+                lo += 1
+            first[node] = len(labels)
+            while lo < hi:
+                # Find the range of the pinYins sharing the next letter
+                prefix = keys[lo][:depth + 1]
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                nxt = bisect.bisect_left(keys, upper, lo, hi)
+                child = len(labels)
+                labels.append(ord(prefix[-1]))
+                first.append(0)
+                degree.append(0)
+                ends.append(-1)
+                queue.append((child, lo, nxt, depth + 1))
+                lo = nxt
+            degree[node] = len(labels) - first[node]
+
+        self.keys = keys
+        self.frozen = False
+        self.labels = labels
+        self.first = first
+        self.degree = degree
+        self.ends = ends
+        self.counts = [array('q', [e.get(key, 0) for key in keys])
+                       for e in counts]
+        self.count_totals = [sum(e) for e in self.counts]
+
+        # Sources of the pinYins ending at the nodes
+        self.end_masks = array('B', [0]) * len(labels)
+        for node in range(len(labels)):
+            if ends[node] >= 0:
+                key = keys[ends[node]]
+                for s, e in enumerate(counts):
+                    if key in e:
+                        self.end_masks[node] |= 1 << s
+        self._rank_all()
+
+    def _rank_all(self):
+        # Rank the top-k pinYins of every node and source,
+        # and mask the sources under every node,
+        # the children always follow their parent in the breadth-first order,
+        # so the nodes are ranked backward, from the leaves to the root
+        k = self.top_k
+        num = len(self.labels)
+        masks = array('B', [0]) * num
+        tops = [array('i', [-1]) * (k * num) for _ in self.counts]
+        for node in range(num - 1, -1, -1):
+            lo = self.first[node]
+            children = range(lo, lo + self.degree[node])
+            mask = self.end_masks[node]
+            for child in children:
+                mask |= masks[child]
+            masks[node] = mask
+
+            for s, (top, counts) in enumerate(zip(tops, self.counts)):
+                if not mask >> s & 1:
+                    continue
+                ranked = []
+                if self.end_masks[node] >> s & 1:
+                    ranked.append(self.ends[node])
+                for child in children:
+                    ranked.extend(e for e in top[child * k:(child + 1) * k]
+                                  if e >= 0)
+                ranked.sort(key=lambda e: counts[e], reverse=True)
+                ranked = ranked[:k]
+                top[node * k:node * k + len(ranked)] = array('i', ranked)
+        self.masks = masks
+        self.tops = tops
+
+    def child(self, node, c):
+        # Move from [node] using the letter [c],
+        # return None if it can not move forward
+        lo = self.first[node]
+        hi = lo + self.degree[node]
+        o = ord(c)
+        pos = bisect.bisect_left(self.labels, o, lo, hi)
+        if pos < hi and self.labels[pos] == o:
+            return pos
+        return None
+
+    def is_end(self, node, source=None):
+        # Tell if a pinYin of the [source] ends at the [node],
+        # None refers any source
+        if source is None:
+            return self.ends[node] >= 0
+        return self.end_masks[node] >> source & 1 == 1
+
+    def has_source(self, node, source):
+        # Tell if the [source] has pinYins under the [node]
+        return self.masks[node] >> source & 1 == 1
+
+    def children(self, node):
+        # The (letter, child) pairs of the [node]
+        lo = self.first[node]
+        return [(chr(self.labels[pos]), pos)
+                for pos in range(lo, lo + self.degree[node])]
+
+    def weight(self, node):
+        # Count of the most frequent pinYin under the [node] of any source
+        k = self.top_k
+        return max([self.counts[s][top[node * k]]
+                    for s, top in enumerate(self.tops)
+                    if top[node * k] >= 0], default=0)
+
+    def _append_node(self, pos=None, label=0):
+        # Append new node to the arrays,
+        # it is the copy of the node [pos] if provided,
+        # otherwise it is the empty leaf with [label]
+        k = self.top_k
+        if pos is None:
+            for (name, _), value in zip(NODE_ARRAYS, [label, 0, 0, -1, 0, 0]):
+                getattr(self, name).append(value)
+            for top in self.tops:
+                top.extend([-1] * k)
+        else:
+            for name, _ in NODE_ARRAYS:
+                values = getattr(self, name)
+                values.append(values[pos])
+            for top in self.tops:
+                top.extend(top[pos * k:(pos + 1) * k])
+        return len(self.labels) - 1
+
+    def _insert_child(self, node, c):
+        # Add new child [c] to the [node],
+        # the children block is copied to the end of the arrays,
+        # with the new child in the sorted position,
+        # the old block is left as garbage
+        lo = self.first[node]
+        hi = lo + self.degree[node]
+        o = ord(c)
+        new_first = len(self.labels)
+        new_child = None
+        for pos in range(lo, hi + 1):
+            if new_child is None and (pos == hi or self.labels[pos] > o):
+                new_child = self._append_node(label=o)
+            if pos < hi:
+                self._append_node(pos)
+        self.first[node] = new_first
+        self.degree[node] += 1
+        return new_child
+
+    def add(self, pinYin, count=None, source=0):
+        # Add new [pinYin] of the [source] to the tree
+        # [count] is the frequency of the [pinYin],
+        # None refers keeping the known count
+        # Adding is from the root
+        self._thaw()
+        self._source(source)
+        path = [self.root]
+        for c in pinYin:
+            nxt = self.child(path[-1], c)
+            if nxt is None:
+                nxt = self._insert_child(path[-1], c)
+            path.append(nxt)
+        # Reach the end of the pinYin
+        node = path[-1]
+        if self.ends[node] < 0:
+            self.ends[node] = len(self.keys)
+            self.keys.append(pinYin)
+            for counts in self.counts:
+                counts.append(0)
+        idx = self.ends[node]
+        counts = self.counts[source]
+        if count is not None:
+            self.count_totals[source] = (self.total(source) + count
+                                         - counts[idx])
+            counts[idx] = count
+
+        # Update the masks and the top-k of the nodes on the path
+        bit = 1 << source
+        self.end_masks[node] |= bit
+        for node in path:
+            self.masks[node] |= bit
+            self._rank(node, idx, source)
+
+    def _rank(self, node, idx, source):
+        # Put the pinYin of [idx] into the top-k of the [source] in the [node]
+        k = self.top_k
+        counts = self.counts[source]
+        top = [e for e in self.tops[source][node * k:(node + 1) * k]
+               if e >= 0 and e != idx]
+        count = counts[idx]
+        pos = 0
+        while pos < len(top) and not counts[top[pos]] < count:
+            pos += 1
+        top.insert(pos, idx)
+        top = top[:k]
+        top.extend([-1] * (k - len(top)))
+        self.tops[source][node * k:(node + 1) * k] = array('i', top)
+
+    def total(self, source=0):
+        # Total count of the pinYins of the [source],
+        # it is summed on the first call for the tree on existing arrays
+        if source >= len(self.count_totals):
+            return 0
+        if self.count_totals[source] is None:
+            self.count_totals[source] = sum(self.counts[source])
+        return self.count_totals[source]
+
+    def top_ends(self, node, source=0):
+        # The top-k most frequent pinYins of the [source] under the [node],
+        # they are ranked when the tree is built
+        if source >= len(self.tops):
+            return []
+        k = self.top_k
+        return [self.keys[e]
+                for e in self.tops[source][node * k:(node + 1) * k]
+                if e >= 0]
+
+    def walk_through(self, track, source=0):
+        # Walk through the tree using the [track],
+        # the found dict is the same as PinYinTree.walk_through
+        return path_founds(self, track, walk_path(self, track), source)
+
+    def walk_to_ends(self, node, limit=3):
+        # Walk from [node] to every available ends,
+        # [limit] is the maximum allowed ends,
+        # the children are visited in the letter order,
+        # use top_ends for the most frequent ones
+        ends = []
+        lo = self.first[node]
+        stack = list(range(lo + self.degree[node] - 1, lo - 1, -1))
+        while stack and len(ends) < limit:
+            node = stack.pop()
+            if self.ends[node] >= 0:
+                ends.append(self.keys[self.ends[node]])
+            lo = self.first[node]
+            stack.extend(range(lo + self.degree[node] - 1, lo - 1, -1))
+        return ends
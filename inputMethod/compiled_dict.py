@@ -0,0 +1,302 @@
+# File: compiled_dict.py
+# Package: inputMethod
+# Aim: Compile the merged frame into binary file and load it with mmap
+
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+import pandas as pd
+
+from .compact_tree import CompactPinYinTree
+
+logger = logging.getLogger('Engine')
+
+# Layout of the compiled file, all numbers are little-endian:
+#   header: MAGIC, VERSION, top_k, number of keys, number of strings,
+#   section table: (offset, length) of every section in SECTIONS,
+#   sections: aligned to 8 bytes.
+# The keys are the first strings of the string table, in the sorted order,
+# so the index of a key is the same in the tree and the string table.
+MAGIC = b'PYIMDICT'
+VERSION = 2
+HEADER = struct.Struct('<8sIIII')
+SECTION = struct.Struct('<QQ')
+
+# Name and typecode of every section, in the file order
+SECTIONS = [
+    # Utf-8 bytes of the strings and their offsets
+    ('strings', 'B'),
+    ('string_offsets', 'I'),
+    # Count of every key
+    ('counts', 'q'),
+    # Arrays of the CompactPinYinTree, the keys are in the source 0
+    ('labels', 'H'),
+    ('first', 'i'),
+    ('degree', 'H'),
+    ('ends', 'i'),
+    ('masks', 'B'),
+    ('end_masks', 'B'),
+    ('top', 'i'),
+    # Candidates of the key j are in the range of
+    # cand_offsets[j]:cand_offsets[j + 1],
+    # they are ranked by the count in the descending order
+    ('cand_offsets', 'I'),
+    ('cand_words', 'i'),
+    ('cand_counts', 'q'),
+]
+
+
+def is_compiled(path):
+    # Tell if the file in [path] is compiled dictionary
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def up_to_date(path, source_path):
+    # Tell if the compiled file in [path] is compiled dictionary
+    # not older than its source merged.json in [source_path],
+    # the missing source leaves the compiled file the only choice
+    if not is_compiled(path):
+        return False
+    if not os.path.isfile(source_path):
+        return True
+    return os.path.getmtime(path) >= os.path.getmtime(source_path)
+
+
+def dict_path(path, source_path):
+    # The path of the dict to load,
+    # the compiled file in [path] if it is up to date,
+    # or the merged.json in [source_path],
+    # the stale compiled file is not loaded,
+    # since it misses the changes of the merged.json
+    if up_to_date(path, source_path):
+        return path
+    if is_compiled(path):
+        logger.warning(f'{path} is older than {source_path}, '
+                       'load the latter instead')
+    return source_path
+
+
+def compile_dict(frame, path, top_k=3):
+    # Compile the [frame] into the binary file in [path],
+    # the [frame] is the merged frame with Count and Candidates columns
+    t = time.time()
+    if sys.byteorder != 'little':
+        raise NotImplementedError('Only little-endian machines are supported')
+
+    counts = frame.Count.to_dict()
+    tree = CompactPinYinTree(top_k=top_k)
+    tree._build([counts])
+    keys = tree.keys
+
+    # String table, the keys go first
+    strings = list(keys)
+    string_ids = {e: j for j, e in enumerate(strings)}
+
+    cand_offsets = array('I', [0])
+    cand_words = array('i')
+    cand_counts = array('q')
+    candidates = frame.Candidates.to_dict()
+    for key in keys:
+        cands = candidates.get(key)
+        if not isinstance(cands, dict):
+            cands = dict()
+        for word, count in sorted(cands.items(), key=lambda x: x[1],
+                                  reverse=True):
+            if word not in string_ids:
+                string_ids[word] = len(strings)
+                strings.append(word)
+            cand_words.append(string_ids[word])
+            cand_counts.append(int(count))
+        cand_offsets.append(len(cand_words))
+
+    blob = bytearray()
+    string_offsets = array('I', [0])
+    for string in strings:
+        blob.extend(string.encode('utf-8'))
+        string_offsets.append(len(blob))
+
+    sections = dict(
+        strings=bytes(blob),
+        string_offsets=string_offsets.tobytes(),
+        counts=tree.counts[0].tobytes(),
+        labels=tree.labels.tobytes(),
+        first=tree.first.tobytes(),
+        degree=tree.degree.tobytes(),
+        ends=tree.ends.tobytes(),
+        masks=tree.masks.tobytes(),
+        end_masks=tree.end_masks.tobytes(),
+        top=tree.tops[0].tobytes(),
+        cand_offsets=cand_offsets.tobytes(),
+        cand_words=cand_words.tobytes(),
+        cand_counts=cand_counts.tobytes(),
+    )
+
+    # Place the sections after the header and the section table
+    pos = HEADER.size + SECTION.size * len(SECTIONS)
+    table = []
+    for name, _ in SECTIONS:
+        pos += -pos % 8
+        table.append((pos, len(sections[name])))
+        pos += len(sections[name])
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, top_k, len(keys), len(strings)))
+        for offset, length in table:
+            f.write(SECTION.pack(offset, length))
+        for (name, _), (offset, length) in zip(SECTIONS, table):
+            f.write(b'\x00' * (offset - f.tell()))
+            f.write(sections[name])
+
+    logger.debug('Compiling {} keys used {} seconds'.format(
+        len(keys), time.time() - t))
+
+
+class StringTable(object):
+    # Read-only sequence of the strings in the compiled file,
+    # the strings are decoded on demand
+    def __init__(self, blob, offsets, size):
+        self.blob = blob
+        self.offsets = offsets
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, j):
+        if j < 0 or j >= self.size:
+            raise IndexError(j)
+        return str(self.blob[self.offsets[j]:self.offsets[j + 1]], 'utf-8')
+
+
+class CompiledCandidates(object):
+    # Read-only dict-like candidates of the keys,
+    # the value of a key is the ranked list of (word, count)
+    def __init__(self, compiled):
+        self.compiled = compiled
+
+    def index(self, key):
+        # Index of the [key], -1 if it is not found
+        keys = self.compiled.keys
+        j = bisect.bisect_left(keys, key)
+        if j < len(keys) and keys[j] == key:
+            return j
+        return -1
+
+    def __len__(self):
+        return len(self.compiled.keys)
+
+    def __contains__(self, key):
+        return self.index(key) >= 0
+
+    def __iter__(self):
+        return iter(self.compiled.keys)
+
+    def __getitem__(self, key):
+        j = self.index(key)
+        if j < 0:
+            raise KeyError(key)
+        return self.ranked(j)
+
+    def get(self, key, default=None):
+        j = self.index(key)
+        if j < 0:
+            return default
+        return self.ranked(j)
+
+    def ranked(self, j):
+        # Ranked candidates of the [j]-th key
+        c = self.compiled
+        lo, hi = c.cand_offsets[j], c.cand_offsets[j + 1]
+        return [(c.strings[w], n)
+                for w, n in zip(c.cand_words[lo:hi], c.cand_counts[lo:hi])]
+
+
+class CompiledDict(object):
+    # Compiled dictionary loaded with mmap,
+    # nothing is parsed on loading,
+    # the processes using the same file share the same page cache
+    def __init__(self, path):
+        t = time.time()
+        if sys.byteorder != 'little':
+            raise NotImplementedError(
+                'Only little-endian machines are supported')
+
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+
+        magic, version, top_k, num_keys, num_strings = HEADER.unpack_from(
+            self.mm, 0)
+        if not magic == MAGIC:
+            raise ValueError(f'{path} is not compiled dictionary')
+        if not version == VERSION:
+            raise ValueError(
+                f'{path} is compiled in version {version}, '
+                f'but version {VERSION} is required, please compile it again')
+        self.top_k = top_k
+
+        view = memoryview(self.mm)
+        for j, (name, code) in enumerate(SECTIONS):
+            offset, length = SECTION.unpack_from(
+                self.mm, HEADER.size + j * SECTION.size)
+            setattr(self, name, view[offset:offset + length].cast(code))
+
+        self.strings = StringTable(self.strings, self.string_offsets,
+                                   num_strings)
+        self.keys = StringTable(self.strings.blob, self.string_offsets,
+                                num_keys)
+        logger.debug('Loading {} used {} seconds'.format(
+            path, time.time() - t))
+
+    def tree(self):
+        # The CompactPinYinTree on the mapped arrays,
+        # the keys are in the source 0,
+        # the arrays are copied on the first change of the tree
+        return CompactPinYinTree.from_arrays(
+            keys=self.keys,
+            labels=self.labels,
+            first=self.first,
+            degree=self.degree,
+            ends=self.ends,
+            masks=self.masks,
+            end_masks=self.end_masks,
+            counts=[self.counts],
+            tops=[self.top],
+            top_k=self.top_k,
+        )
+
+    def candidates(self):
+        # The dict-like candidates
+        return CompiledCandidates(self)
+
+    def to_frame(self):
+        # Convert into the merged frame,
+        # it is slow and only for inspection
+        candidates = self.candidates()
+        keys = list(self.keys)
+        return pd.DataFrame(dict(
+            Count=list(self.counts),
+            Candidates=[dict(candidates.ranked(j))
+                        for j in range(len(keys))],
+        ), index=keys)
+
+
+# %%
+if __name__ == '__main__':
+    # Compile the merged.json into merged.bin,
+    #   python -m inputMethod.compiled_dict [merged.json] [merged.bin]
+    from . import _cellDict_path, _compiled_path
+    src = sys.argv[1] if len(sys.argv) > 1 else _cellDict_path
+    dst = sys.argv[2] if len(sys.argv) > 2 else _compiled_path
+    logger.setLevel(logging.DEBUG)
+    compile_dict(pd.read_json(src), dst)
+    print(f'Compiled {src} into {dst}')
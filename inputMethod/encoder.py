@@ -0,0 +1,12 @@
+# File: encoder.py
+# Package: inputMethod
+# Aim: Dump json in the same way as pandas to_json
+
+import json
+
+
+def dumps(obj):
+    # Dump [obj] into json string in the same way as pandas to_json,
+    # no white spaces, non-ascii and forward slash are escaped,
+    # it is shared by the engine, IMServer and build_cellDict.py
+    return json.dumps(obj, separators=(',', ':')).replace('/', '\\/')
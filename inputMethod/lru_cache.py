@@ -0,0 +1,72 @@
+# File: lru_cache.py
+# Package: inputMethod
+# Aim: Provide size-bounded LRU cache with hit and miss counters
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    # Size-bounded cache,
+    # the least recently used item is evicted when it is full,
+    # the [maxsize] of 0 disables the cache
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def keys(self):
+        return list(self.items)
+
+    def get(self, key, default=None):
+        # Get the value of [key],
+        # the [default] is returned if it is not cached
+        if key not in self.items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def peek(self, key, default=None):
+        # Get the value of [key] without touching the counters and the order
+        return self.items.get(key, default)
+
+    def put(self, key, value):
+        # Cache the [value] of [key]
+        if self.maxsize <= 0:
+            return
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        # Remove the [key] since its value is out of date
+        if self.items.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.items.clear()
+
+    def stats(self):
+        # Counters of the cache, they are used to size it
+        total = self.hits + self.misses
+        return dict(
+            size=len(self.items),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+            hit_rate=self.hits / total if total else 0.0,
+        )
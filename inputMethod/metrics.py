@@ -0,0 +1,135 @@
+# File: metrics.py
+# Package: inputMethod
+# Aim: Provide low-overhead latency histograms, counters and gauges
+
+import bisect
+import threading
+
+# Upper bounds of the latency buckets in seconds,
+# from 1 microsecond to about 100 seconds,
+# every bound is 2 ** (1 / 8) times the last one,
+# so the percentiles are within 9% of the truth
+BOUNDS = [1e-6 * 2 ** (j / 8) for j in range(8 * 27)]
+
+# Percentiles in the report
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram(object):
+    # Histogram of the values in the fixed buckets,
+    # recording a value costs one bisect,
+    # the percentiles are the upper bounds of the buckets
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        # The [q] percentile, q is in [0, 1]
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for j, num in enumerate(self.buckets):
+            seen += num
+            if seen >= rank and num > 0:
+                if j == len(self.bounds):
+                    return self.max
+                return min(self.bounds[j], self.max)
+        return self.max
+
+    def summary(self):
+        # Count, mean, max and the percentiles in QUANTILES
+        summary = dict(count=self.count,
+                       mean=self.total / self.count if self.count else 0,
+                       max=self.max)
+        for q in QUANTILES:
+            summary[f'p{round(q * 100)}'] = self.percentile(q)
+        return summary
+
+
+# Buckets of the result sizes, 0, 1, 2, 4, ... 2 ** 20
+SIZE_BOUNDS = [0] + [2 ** j for j in range(21)]
+
+
+class Metrics(object):
+    # Metrics of the calls,
+    # every call has the histograms of its latency and result size,
+    # the counters count the events, like the errors,
+    # the gauges are the functions called on reporting, like the hit rates
+    def __init__(self):
+        self.latencies = dict()
+        self.sizes = dict()
+        self.counters = dict()
+        self.gauges = dict()
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds, size=None):
+        # Record the call of [name] costing [seconds],
+        # with the result of [size]
+        with self.lock:
+            if name not in self.latencies:
+                self.latencies[name] = Histogram()
+                self.sizes[name] = Histogram(SIZE_BOUNDS)
+            self.latencies[name].record(seconds)
+            if size is not None:
+                self.sizes[name].record(size)
+
+    def calls(self, name):
+        # Number of the recorded calls of [name]
+        if name not in self.latencies:
+            return 0
+        return self.latencies[name].count
+
+    def count(self, name, num=1):
+        # Count the event of [name]
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + num
+
+    def gauge(self, name, func):
+        # Report the value of [func]() as [name]
+        self.gauges[name] = func
+
+    def snapshot(self):
+        # Dict of the current metrics
+        with self.lock:
+            snapshot = dict(
+                latencies={name: e.summary()
+                           for name, e in self.latencies.items()},
+                sizes={name: e.summary() for name, e in self.sizes.items()
+                       if e.count > 0},
+                counters=dict(self.counters),
+            )
+        snapshot['gauges'] = {name: func()
+                              for name, func in self.gauges.items()}
+        return snapshot
+
+    def render(self, prefix=''):
+        # The metrics in the text format,
+        # one "name{labels} value" per line
+        snapshot = self.snapshot()
+        lines = []
+        for kind, unit in [('latencies', 'seconds'), ('sizes', 'size')]:
+            for name, summary in snapshot[kind].items():
+                metric = f'{prefix}{name}_{unit}'
+                for q in QUANTILES:
+                    value = summary[f'p{round(q * 100)}']
+                    lines.append(f'{metric}{{quantile="{q}"}} {value:g}')
+                lines.append(f'{metric}_mean {summary["mean"]:g}')
+                lines.append(f'{metric}_max {summary["max"]:g}')
+                if kind == 'latencies':
+                    lines.append(f'{prefix}{name}_count {summary["count"]}')
+        for name, value in snapshot['counters'].items():
+            lines.append(f'{prefix}{name}_total {value}')
+        for name, value in snapshot['gauges'].items():
+            lines.append(f'{prefix}{name} {value:g}')
+        return '\n'.join(lines) + '\n'
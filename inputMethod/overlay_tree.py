@@ -0,0 +1,101 @@
+# File: overlay_tree.py
+# Package: inputMethod
+# Aim: Walk the read-only system tree and the mutable user tree together
+
+from .tree_walk import path_founds, walk_path
+
+
+class OverlayTree(object):
+    # Two pinYin trees walked as one index, with the interface of PinYinTree,
+    # the base tree holds the [base_sources], like the system dict,
+    # it is never changed, so the mapped arrays of the compiled file
+    # stay shared and read-only,
+    # the overlay tree holds the other sources, like the user dict,
+    # every node is the pair of (base node, overlay node),
+    # either is None where the tree can not move forward
+    def __init__(self, base, overlay, base_sources=(0,)):
+        self.base = base
+        self.overlay = overlay
+        self.base_sources = set(base_sources)
+        self.root = (base.root, overlay.root)
+
+    def tree(self, source):
+        # The tree holding the [source]
+        if source in self.base_sources:
+            return self.base
+        return self.overlay
+
+    def _node(self, node, source):
+        # The node of the tree holding the [source]
+        if source in self.base_sources:
+            return node[0]
+        return node[1]
+
+    def generate(self, frame, source=0):
+        # Generate based on [frame] as the [source],
+        # the new source goes to the overlay tree
+        self.tree(source).generate(frame, source)
+
+    def add(self, pinYin, count=None, source=0):
+        # Add new [pinYin] of the [source], see PinYinTree.add
+        self.tree(source).add(pinYin, count, source)
+
+    def child(self, node, c):
+        # Move from [node] using the letter [c],
+        # return None if neither tree can move forward
+        base, over = node
+        if base is not None:
+            base = self.base.child(base, c)
+        if over is not None:
+            over = self.overlay.child(over, c)
+        if base is None and over is None:
+            return None
+        return (base, over)
+
+    def is_end(self, node, source=None):
+        # Tell if a pinYin of the [source] ends at the [node],
+        # None refers any source
+        if source is None:
+            return any([node[0] is not None and self.base.is_end(node[0]),
+                        node[1] is not None and self.overlay.is_end(node[1])])
+        sub = self._node(node, source)
+        return sub is not None and self.tree(source).is_end(sub, source)
+
+    def has_source(self, node, source):
+        # Tell if the [source] has pinYins under the [node]
+        sub = self._node(node, source)
+        return sub is not None and self.tree(source).has_source(sub, source)
+
+    def top_ends(self, node, source=0):
+        # The top-k most frequent pinYins of the [source] under the [node]
+        sub = self._node(node, source)
+        if sub is None:
+            return []
+        return self.tree(source).top_ends(sub, source)
+
+    def total(self, source=0):
+        # Total count of the pinYins of the [source]
+        return self.tree(source).total(source)
+
+    def children(self, node):
+        # The (letter, child) pairs of the [node], sorted by the letter
+        base, over = node
+        children = dict()
+        if base is not None:
+            for c, child in self.base.children(base):
+                children[c] = (child, None)
+        if over is not None:
+            for c, child in self.overlay.children(over):
+                children[c] = (children.get(c, (None,))[0], child)
+        return sorted(children.items())
+
+    def weight(self, node):
+        # Count of the most frequent pinYin under the [node] of any source
+        return max([tree.weight(sub)
+                    for tree, sub in zip([self.base, self.overlay], node)
+                    if sub is not None], default=0)
+
+    def walk_through(self, track, source=0):
+        # Walk through both trees using the [track],
+        # the found dict is the same as PinYinTree.walk_through
+        return path_founds(self, track, walk_path(self, track), source)
@@ -3,19 +3,38 @@
 # Aim: Provide functional engine of pinYin inputMethod interface
 
 # %%
+import heapq
 import json
 import logging
 import os
 import sys
 import pandas as pd
+import threading
 import time
 
+from .compact_tree import CompactPinYinTree
+from .compiled_dict import CompiledDict, is_compiled
+from .encoder import dumps
+from .lru_cache import LRUCache
+from .metrics import Metrics
+from .overlay_tree import OverlayTree
+from .prefetcher import Prefetcher
+from .tree_walk import MAX_SOURCES, path_founds, walk_path
+from .user_journal import UserJournal
+
 logger = logging.getLogger('Engine')
 handler = logging.StreamHandler(sys.stdout)
 if len(logger.handlers) == 0:
     logger.addHandler(handler)
 logger.setLevel(logging.DEBUG)
 
+# Sentinel keys in the nodes of the PinYinTree
+SENTINELS = ('=', '#', '@', '+')
+
+# Sources of the engine
+SYSTEM = 0
+USER = 1
+
 
 def merge_dicts(dicts):
     if isinstance(dicts, dict):
@@ -34,25 +53,174 @@ def merge_dicts(dicts):
     return sorted(merged.items(), key=lambda x: x[1], reverse=True)
 
 
+def merge_ranked(lists, limit=None):
+    # Merge the ranked lists of (word, count),
+    # the counts of the same word are summed,
+    # the merged list is ranked and has at most [limit] items.
+    # The longest list is streamed in its order,
+    # and the words in the other lists are looked up,
+    # so the merge stops once the top [limit] are settled.
+    lists = sorted([e for e in lists if e], key=len)
+    if len(lists) == 0:
+        return []
+    if len(lists) == 1:
+        return list(lists[0][:limit])
+
+    longest = lists.pop()
+    merged = dict()
+    for lst in lists:
+        for word, count in lst:
+            merged[word] = merged.get(word, 0) + count
+    # The most that the other lists add to a word of the longest list
+    bonus = sum(lst[0][1] for lst in lists)
+
+    # Min-heap of the top [limit] totals
+    top = []
+    for word, count in longest:
+        if limit is not None and len(top) == limit and count + bonus < top[0]:
+            # No more words can be in the top
+            break
+        total = count + merged.get(word, 0)
+        merged[word] = total
+        if limit is None:
+            continue
+        if len(top) < limit:
+            heapq.heappush(top, total)
+        elif total > top[0]:
+            heapq.heapreplace(top, total)
+
+    ranked = sorted(merged.items(), key=lambda x: x[1], reverse=True)
+    return ranked[:limit]
+
+
+def rank_dict(dct):
+    # Rank the candidates of the [dct] by the count,
+    # return the list of (word, count)
+    if not isinstance(dct, dict):
+        return []
+    return sorted(dct.items(), key=lambda x: x[1], reverse=True)
+
+
+def frame_candidates(frame):
+    # Ranked candidates of every pinYin in the [frame] as plain dict,
+    # they are ranked once on loading, see rank_dict
+    if 'Candidates' not in frame.columns:
+        return dict()
+    return {pinYin: rank_dict(dct)
+            for pinYin, dct in frame.Candidates.to_dict().items()}
+
+
+def page_rows(rows, limit=None, offset=0, cap=None):
+    # The page of the [rows] of the CheckoutResult,
+    # the [limit] rows from the [offset] are selected, None refers all,
+    # the candidates of every row are cut to the top [cap], None refers all,
+    # they are ranked already, so the cut is a slice,
+    # the Num is kept as the number of all the candidates
+    end = None if limit is None else offset + limit
+    rows = rows[offset:end]
+    if cap is not None:
+        rows = [(prefix, remain, full, ranked[:cap], num)
+                for prefix, remain, full, ranked, num in rows]
+    return rows
+
+
+class CheckoutResult(object):
+    # Lightweight result of the checkout,
+    # every row is the tuple of (Prefix, Remain, Full, Candidates, Num),
+    # the DataFrame is only built when it is asked by to_frame
+    columns = ['Prefix', 'Remain', 'Full', 'Candidates', 'Num']
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_frame(self):
+        # Convert into DataFrame
+        return pd.DataFrame(self.rows, columns=self.columns)
+
+    def to_json(self):
+        # Convert into json string,
+        # it is the same as to_frame().to_json()
+        if len(self.rows) == 0:
+            return '{}'
+        return dumps({
+            name: {str(j): row[i] for j, row in enumerate(self.rows)}
+            for i, name in enumerate(self.columns)
+        })
+
+
+def output_format(return_json, return_frame):
+    # Name of the output format of the checkout
+    if return_json:
+        return 'json'
+    if return_frame:
+        return 'frame'
+    return 'result'
+
+
+def frame_counts(frame):
+    # Count of every pinYin in the [frame],
+    # the frame without Count column has no counts
+    if 'Count' not in frame.columns:
+        return dict()
+    return frame.Count.to_dict()
+
+
 class PinYinTree(object):
-    # PinYin tree for quickly checkout
-    def __init__(self):
+    # PinYin tree for quickly checkout,
+    # every node is a dict of the next letters,
+    # the pinYins come from several sources, like the user and system dicts,
+    # the source is the index of the dict, up to MAX_SOURCES,
+    # the sentinel keys are:
+    #   '=': the pinYin ending at the node,
+    #   '#': bit mask of the sources having the pinYin ending at the node,
+    #   '@': bit mask of the sources having pinYins under the node,
+    #   '+': dict of the source and its top-k most frequent pinYins under the node
+    def __init__(self, top_k=3):
         self.root = dict()
+        self.top_k = top_k
+        # Count of every known pinYin of every source,
+        # it ranks the top-k pinYins
+        self.counts = []
+        self.count_totals = []
         logger.debug('Tree initalized')
 
-    def generate(self, frame):
-        # Generate based on [frame]
+    def _source(self, source):
+        # Make sure the [source] is ready
+        if not 0 <= source < MAX_SOURCES:
+            raise ValueError(f'The source should be in [0, {MAX_SOURCES})')
+        while len(self.counts) <= source:
+            self.counts.append(dict())
+            self.count_totals.append(0)
+
+    def generate(self, frame, source=0):
+        # Generate based on [frame] as the [source]
         # Count the elapsed time,
         # since it may slow
         t = time.time()
+        counts = frame_counts(frame)
         for pinYin in frame.index:
-            self.add(pinYin)
+            self.add(pinYin, counts.get(pinYin, 0), source)
         logger.debug('Tree generation used {} seconds'.format(time.time() - t))
 
-    def add(self, pinYin):
-        # Add new [pinYin] to the tree
+    def add(self, pinYin, count=None, source=0):
+        # Add new [pinYin] of the [source] to the tree
+        # [count] is the frequency of the [pinYin],
+        # None refers keeping the known count
+        self._source(source)
+        counts = self.counts[source]
+        if count is None:
+            count = counts.get(pinYin, 0)
+        self.count_totals[source] += count - counts.get(pinYin, 0)
+        counts[pinYin] = count
+        bit = 1 << source
+
         # Adding is from the root
         node = self.root
+        node['@'] = node.get('@', 0) | bit
+        self._rank(node, pinYin, source)
         # Add characters one-by-one, step-by-step
         for c in pinYin:
             if c not in node:
@@ -60,185 +228,521 @@ class PinYinTree(object):
                 node[c] = dict()
             # Move forward
             node = node[c]
+            node['@'] = node.get('@', 0) | bit
+            self._rank(node, pinYin, source)
         # Reach the end of the pinYin
         node['='] = pinYin
-
-    def walk_through(self, track):
-        # Walk through the tree using the [track],
-        # record the known pinYins during the travel,
-        # the remains and the found will be recorded synchronously.
-        # Found dict will be returned,
-        # every found value is fixed structure: [mainbody, remain],
-        # mainbody is the matched or guessed string prefix,
-        #          if the mainbody is guessed, it will end with "..."
-        # remain is the remaining of the mainbody
-        founds = dict()
-
-        node = self.root
+        node['#'] = node.get('#', 0) | bit
+
+    def _rank(self, node, pinYin, source):
+        # Put the [pinYin] into the top-k list of the [source] in the [node]
+        counts = self.counts[source]
+        tops = node.setdefault('+', dict())
+        top = tops.get(source, [])
+        if pinYin in top:
+            top.remove(pinYin)
+        count = counts[pinYin]
         pos = 0
-        while pos < len(track):
-            # print(track[:pos])
-            if '=' in node:
-                # Find known pinYin
-                founds[track[:pos]] = [track[:pos], track[pos:]]
-                # for guessed in self.walk_to_ends(node):
-                #     founds[guessed] = ['{}...'.format(track[:pos]),
-                #                        track[pos:]]
-
-            if track[pos] not in node:
-                if pos == 0:
-                    return founds
-                # Can not move forward
-                # founds[track[:pos]] = [track[:pos], track[pos:]]
-                if '=' not in node:
-                    for guessed in self.walk_to_ends(node):
-                        founds[guessed] = ['{}...'.format(track[:pos]),
-                                           track[pos:]]
-                return founds
-
-            if track[pos] in node:
-                # Can move forward
-                node = node[track[pos]]
-                pos += 1
-                continue
-
-        founds[track] = [track, '']
-        if '=' not in node:
-            for guessed in self.walk_to_ends(node):
-                founds[guessed] = ['{}...'.format(track), '']
-
-        return founds
+        while pos < len(top) and not counts[top[pos]] < count:
+            pos += 1
+        top.insert(pos, pinYin)
+        tops[source] = top[:self.top_k]
+
+    def top_ends(self, node, source=0):
+        # The top-k most frequent pinYins of the [source] under the [node],
+        # they are ranked when the tree is built
+        return node.get('+', {}).get(source, [])
+
+    def total(self, source=0):
+        # Total count of the pinYins of the [source]
+        if source < len(self.count_totals):
+            return self.count_totals[source]
+        return 0
+
+    def child(self, node, c):
+        # Move from [node] using the letter [c],
+        # return None if it can not move forward
+        if c in SENTINELS:
+            return None
+        return node.get(c, None)
+
+    def is_end(self, node, source=None):
+        # Tell if a pinYin of the [source] ends at the [node],
+        # None refers any source
+        if source is None:
+            return '=' in node
+        return node.get('#', 0) >> source & 1 == 1
+
+    def has_source(self, node, source):
+        # Tell if the [source] has pinYins under the [node]
+        return node.get('@', 0) >> source & 1 == 1
+
+    def children(self, node):
+        # The (letter, child) pairs of the [node]
+        return [(c, node[c]) for c in node if c not in SENTINELS]
+
+    def weight(self, node):
+        # Count of the most frequent pinYin under the [node] of any source
+        return max([self.counts[s][top[0]]
+                    for s, top in node.get('+', {}).items() if top],
+                   default=0)
+
+    def walk_through(self, track, source=0):
+        # Walk through the tree using the [track],
+        # record the known pinYins of the [source] during the travel,
+        # see path_founds for the found dict
+        return path_founds(self, track, walk_path(self, track), source)
 
     def walk_to_ends(self, node, limit=3):
         # Walk from [node] to every available ends,
-        # [limit] is the maximum allowed ends
-        self.this_ends = []
-        self.this_ends_limit = limit
-        for nxt in [e for e in node if not e == '=']:
-            self._walk_to_ends(node[nxt])
-            if not len(self.this_ends) < self.this_ends_limit:
-                break
-        return self.this_ends
-
-    def _walk_to_ends(self, node):
-        if '=' in node:
-            self.this_ends.append(node['='])
-            if not len(self.this_ends) < self.this_ends_limit:
-                return
-        for nxt in [e for e in node if not e == '=']:
-            if not len(self.this_ends) < self.this_ends_limit:
-                break
-            self._walk_to_ends(node[nxt])
+        # [limit] is the maximum allowed ends,
+        # the ends are in the insertion order,
+        # use top_ends for the most frequent ones
+        ends = []
+        stack = [node[e] for e in reversed(list(node)) if e not in SENTINELS]
+        while stack and len(ends) < limit:
+            node = stack.pop()
+            if '=' in node:
+                ends.append(node['='])
+            stack.extend(node[e] for e in reversed(list(node))
+                         if e not in SENTINELS)
+        return ends
+
+
+# Available backends of the pinYin tree,
+# dict: nested python dicts, easy to read,
+# compact: flat typed arrays, much less memory for large frames
+TREE_BACKENDS = dict(
+    dict=PinYinTree,
+    compact=CompactPinYinTree,
+)
+
+
+class CheckoutSession(object):
+    # Incremental checkout of the input buffer typed letter by letter,
+    # the cursor of the index is kept,
+    # so appending or deleting a letter costs one step in the index
+    def __init__(self, engine):
+        self.engine = engine
+        self.buffer = ''
+        self.reset()
+
+    def reset(self):
+        # Restart the cursor from the root and replay the buffer,
+        # it is required when the index is changed by user learning
+        self.version = self.engine.version
+        self.index = self.engine.index
+        # Nodes passed by the cursor,
+        # path[pos] is the node after [pos] letters,
+        # the path stops growing when the index can not move forward
+        self.path = [self.index.root]
+        buffer = self.buffer
+        self.buffer = ''
+        self.append(buffer)
+
+    def append(self, letters):
+        # Append [letters] to the buffer
+        for c in letters:
+            if len(self.path) == len(self.buffer) + 1:
+                # The cursor is not stuck
+                node = self.index.child(self.path[-1], c)
+                if node is not None:
+                    self.path.append(node)
+            self.buffer += c
+
+    def pop(self, num=1):
+        # Delete the last [num] letters of the buffer
+        self.buffer = self.buffer[:max(len(self.buffer) - num, 0)]
+        del self.path[len(self.buffer) + 1:]
+
+    def set(self, inp):
+        # Set the buffer to [inp],
+        # only the letters after the common prefix are replayed
+        same = 0
+        while (same < min(len(inp), len(self.buffer))
+               and inp[same] == self.buffer[same]):
+            same += 1
+        self.pop(len(self.buffer) - same)
+        self.append(inp[same:])
+
+    def lookup(self, stop=None):
+        # Lookup the buffer,
+        # return the rows of the CheckoutResult, see PinYinEngine.collect
+        if not self.version == self.engine.version:
+            self.reset()
+        return self.engine.collect(self.engine.founds(self.buffer, self.path),
+                                   stop)
+
+    def checkout(self, inp=None, return_json=False, return_frame=True,
+                 limit=None, offset=0, cap=None):
+        # Checkout the buffer, it is set to [inp] if provided,
+        # the outputs are the same as PinYinEngine.checkout
+        if inp is not None:
+            self.set(inp)
+        t = time.perf_counter()
+        stop = None if limit is None else offset + limit
+        rows = page_rows(self.lookup(stop), limit, offset, cap)
+        fetched = self.engine.output(CheckoutResult(rows), return_json,
+                                     return_frame)
+        self.engine.observe('session', self.buffer, t, len(rows))
+        return fetched
 
 
 class PinYinEngine(object):
     # Main engine of parsing pinYin
-    def __init__(self, frame_path):
+    def __init__(self, frame_path, tree_backend='dict', cache_size=1024,
+                 compact_every=1000, prefetch_width=0, log_every=0):
         # Init the engine with dataframe in [frame_path]
-        # Read frame from [frame_path]
-        self.frame = pd.read_json(frame_path)
-        self.tree = PinYinTree()
-        self.tree.generate(self.frame)
-
-        self.user_frame = self.read_user_frame()
-        self.user_tree = PinYinTree()
-        self.user_tree.generate(self.user_frame)
+        # [frame_path] can also be the compiled file, see compiled_dict.py,
+        # it is mapped into memory instead of parsed
+        # [tree_backend] is the key of TREE_BACKENDS
+        # [cache_size] is the max number of cached checkouts, 0 disables it
+        # [compact_every] is the max number of the records in the journal
+        # of user learning, they are compacted into user_frame.json
+        # [prefetch_width] is the number of the next letters prefetched
+        # after every checkout, see prefetcher.py, 0 disables it
+        # [log_every] logs one of every [log_every] calls, 0 disables it,
+        # the latencies of all the calls are in the metrics anyway
+        if tree_backend not in TREE_BACKENDS:
+            raise ValueError(f'Unknown tree backend: {tree_backend}')
+        Tree = TREE_BACKENDS[tree_backend]
+
+        if is_compiled(frame_path):
+            # Map the compiled file,
+            # its tree is always the compact one,
+            # the frame is only built when it is required
+            self.compiled = CompiledDict(frame_path)
+            self._frame = None
+            system = self.compiled.tree()
+            self.candidates = self.compiled.candidates()
+        else:
+            # Read frame from [frame_path]
+            self.compiled = None
+            self._frame = pd.read_json(frame_path)
+            system = Tree()
+            system.generate(self._frame, SYSTEM)
+            self.candidates = frame_candidates(self._frame)
+
+        # The user dict is kept in plain dicts,
+        # the learning is recorded in the journal
+        self.compact_every = compact_every
+        self.read_user_frame()
+
+        # The index walks the system tree and the tree of the other sources
+        # together, the system tree is never changed,
+        # so the compiled one stays mapped and shared, see overlay_tree.py
+        user = Tree()
+        user.generate(self.user_frame, USER)
+        self.index = OverlayTree(system, user, [SYSTEM])
+
+        # The index holds the pinYins of every source,
+        # layers[source] is the ranked candidates of the source,
+        # the rows of the sources are collected in the [order]
+        self.layers = [self.candidates, self.user_ranked]
+        self.order = [USER, SYSTEM]
+
+        # Version of the index and dicts,
+        # it changes on user learning to refresh the sessions
+        self.version = 0
+
+        # Cache of the checkouts,
+        # the key is (inp, format, limit, offset, cap),
+        # the value is (fetched, founds of the user dict, number of rows)
+        self.cache = LRUCache(cache_size)
+
+        # Converter of the whole sentence, see sentence.py
+        self.converter = None
+
+        # The lock of the index and the cache,
+        # they are shared with the prefetcher thread
+        self.lock = threading.RLock()
+        self.prefetcher = None
+        if prefetch_width > 0:
+            self.prefetcher = Prefetcher(self, width=prefetch_width)
+
+        # Latencies and result sizes of the calls, see metrics.py
+        self.log_every = log_every
+        self.metrics = Metrics()
+        self.metrics.gauge('checkout_cache_hit_rate',
+                           lambda: self.cache.stats()['hit_rate'])
+        if self.prefetcher is not None:
+            self.metrics.gauge('prefetch_hit_rate',
+                               lambda: self.prefetcher.stats()['hit_rate'])
 
         self.go = True
 
+    @property
+    def frame(self):
+        # The frame of the system dict,
+        # it is built from the compiled file on the first access
+        if self._frame is None:
+            self._frame = self.compiled.to_frame()
+        return self._frame
+
+    @property
+    def user_frame(self):
+        # The frame of the user dict, it is built on every access
+        return pd.DataFrame(dict(
+            Candidates=self.user_candidates,
+            Count=self.user_counts,
+        ), columns=['Candidates', 'Count'])
+
     def read_user_frame(self):
+        # Read the snapshot in user_frame.json,
+        # and replay the journal on top of it
         folder = os.path.join(os.path.dirname(__file__), '..', 'cellDicts')
-        user_frame_path = os.path.join(folder, 'user_frame.json')
-        if os.path.isfile(user_frame_path):
-            user_frame = pd.read_json(user_frame_path)
-        else:
-            user_frame = pd.DataFrame()
-        self.user_frame_path = user_frame_path
-        return user_frame
+        self.user_frame_path = os.path.join(folder, 'user_frame.json')
+
+        self.user_candidates = dict()
+        self.user_counts = dict()
+        snapshot = dict()
+        if os.path.isfile(self.user_frame_path):
+            with open(self.user_frame_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self.user_candidates.update(snapshot.get('Candidates', {}))
+            self.user_counts.update(snapshot.get('Count', {}))
+        # Ranked candidates of the user dict, see rank_dict
+        self.user_ranked = {pinYin: rank_dict(dct)
+                            for pinYin, dct in self.user_candidates.items()}
+
+        # The records compacted into the snapshot are skipped,
+        # they are left in the journal if the last compaction is interrupted
+        self.journal = UserJournal(
+            os.path.join(folder, 'user_frame.journal'))
+        skip = self.journal.skipped(snapshot.get('Journal'))
+        for pinYin, ciZu in self.journal.replay(skip):
+            self.learn(pinYin, ciZu)
 
     def save_user_frame(self):
-        self.user_frame.to_json(self.user_frame_path)
+        # Compact the journal into the snapshot,
+        # the snapshot is replaced at once,
+        # so it is never half written,
+        # it records the id and the length of the compacted journal,
+        # so they are not replayed again if the journal is not cleared
+        tmp_path = self.user_frame_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(dumps(dict(
+                Candidates=self.user_candidates,
+                Count=self.user_counts,
+                Journal=[self.journal.id, len(self.journal)],
+            )))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.user_frame_path)
+        self.journal.clear()
+
+    def add_layer(self, frame):
+        # Add the [frame] as a new source of the index,
+        # like the domain dict, its rows follow the known sources,
+        # return the new source
+        with self.lock:
+            source = len(self.layers)
+            if source >= MAX_SOURCES:
+                raise ValueError(f'Too many sources, max is {MAX_SOURCES}')
+            self.index.generate(frame, source)
+            self.layers.append(frame_candidates(frame))
+            self.order.append(source)
+
+            self.version += 1
+            self.cache.clear()
+        return source
+
+    def close(self):
+        # Save the user learning, call it before exiting
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+        with self.lock:
+            self.save_user_frame()
+            self.journal.close()
+
+    def learn(self, pinYin, ciZu):
+        # Count the selection of [ciZu] for [pinYin] in the user dict
+        cands = self.user_candidates.setdefault(pinYin, dict())
+        cands[ciZu] = cands.get(ciZu, 0) + 1
+        self.user_counts[pinYin] = self.user_counts.get(pinYin, 0) + 1
+        # The ranked list is replaced rather than changed,
+        # since it may be held by the cached checkouts
+        self.user_ranked[pinYin] = rank_dict(cands)
 
     def add_user_frame(self, pinYin, ciZu):
-        if pinYin not in self.user_frame.index:
-            self.user_frame = self.user_frame.append(pd.Series(dict(
-                Count=0,
-                Candidates={}
-            ), name=pinYin))
-
-        if ciZu not in self.user_frame.loc[pinYin].Candidates:
-            self.user_frame.loc[pinYin].Candidates[ciZu] = 1
-        else:
-            self.user_frame.loc[pinYin].Candidates[ciZu] += 1
-        self.user_frame.Count.loc[pinYin] += 1
+        # Learn the selection of [ciZu] for [pinYin],
+        # it costs one line in the journal,
+        # the user dict, the journal and the compaction are changed
+        # with the engine locked, so the learning threads do not race
+        t = time.perf_counter()
+        with self.lock:
+            self.learn(pinYin, ciZu)
+            self.journal.append(pinYin, ciZu)
 
-        self.user_tree.add(pinYin)
+            self.index.add(pinYin, self.user_counts[pinYin], USER)
+            self.version += 1
+            self.invalidate(pinYin)
 
-        print()
-        print('--------------------------------------')
-        print(self.user_frame)
-        self.save_user_frame()
+            if len(self.journal) >= self.compact_every:
+                self.save_user_frame()
+
+        self.observe('learn', f'{ciZu} for {pinYin}', t, 1)
 
     def has_pinYin(self, pinYin):
         # Tell if the frame has [pinYin] index
         if len(pinYin) == 0:
             return False
-        return pinYin in self.frame.index
+        return pinYin in self.candidates
 
-    def fetch(self, pinYin):
-        # Fetch ciZu of [pinYin] in the frame
-        try:
-            cands = self.frame.Candidates.loc[pinYin]
-        except NameError:
+    def fetch(self, pinYin, limit=None):
+        # Fetch ciZu of [pinYin] in the user dict and the frame,
+        # the top [limit] ciZus are returned as list of (ciZu, count)
+        lists = [self.user_ranked.get(pinYin), self.candidates.get(pinYin)]
+        if not any(lists):
             logger.error(f'Can not fetch {pinYin} from the frame')
             return []
-        return [e for e in cands.items()]
+        return merge_ranked(lists, limit)
 
-    def checkout(self, inp, return_json=False):
+    def checkout(self, inp, return_json=False, return_frame=True,
+                 limit=None, offset=0, cap=None):
         # Checkout [inp] from the frame,
         # the results will be returned as [fetched] in DataFrame type,
-        # the output [fetched] will be converted into json type if [return_json] is set to True
+        # the output [fetched] will be converted into json type if [return_json] is set to True,
+        # the lightweight CheckoutResult will be returned if [return_frame] is set to False,
+        # only the [limit] rows from the [offset] are returned,
+        # with the top [cap] candidates of every row, see page_rows
 
         # Start checkout
-        t = time.time()
-        fetched = pd.DataFrame()
+        t = time.perf_counter()
+
+        # Try the cache first
+        key = (inp, output_format(return_json, return_frame),
+               limit, offset, cap)
+        with self.lock:
+            if self.prefetcher is not None:
+                self.prefetcher.count(key)
+            cached = self.cache.get(key)
+            if cached is None:
+                cached = self.fill(key)
+
+        if self.prefetcher is not None:
+            self.prefetcher.schedule(key)
+
+        fetched = cached[0]
+        if isinstance(fetched, pd.DataFrame):
+            # The cached DataFrame is not allowed to be changed
+            fetched = fetched.copy()
+
+        self.observe('checkout', inp, t, cached[2])
+        return fetched
+
+    def observe(self, name, inp, t, size):
+        # Record the call of [name] for [inp] started at [t],
+        # with the result of [size] rows,
+        # one of every [log_every] calls is logged
+        seconds = time.perf_counter() - t
+        self.metrics.observe(name, seconds, size)
+        calls = self.metrics.calls(name)
+        if self.log_every > 0 and calls % self.log_every == 0:
+            logger.debug(f'{name} {inp} used {seconds} seconds')
+
+    def fill(self, key):
+        # Checkout the [key] of (inp, format, limit, offset, cap)
+        # and cache it, return the cached value
+        inp, fmt, limit, offset, cap = key
+        founds = self.founds(inp)
+        stop = None if limit is None else offset + limit
+        rows = page_rows(self.collect(founds, stop), limit, offset, cap)
+        fetched = self.output(CheckoutResult(rows), fmt == 'json',
+                              fmt == 'frame')
+        cached = (fetched, founds[USER], len(rows))
+        self.cache.put(key, cached)
+        return cached
+
+    def invalidate(self, pinYin):
+        # Remove the cached checkouts affected by the user learning of [pinYin],
+        # only the user source is changed,
+        # and only along the path of the [pinYin],
+        # so the checkouts whose founds of the user dict are the same,
+        # and do not contain [pinYin] are still fresh
+        for key in self.cache.keys():
+            inp = key[0]
+            if len(inp) > 0 and not inp[0] == pinYin[:1]:
+                continue
+            cached = self.cache.peek(key)
+            founds = cached[1]
+            if pinYin in founds or not founds == self.index.walk_through(inp, USER):
+                self.cache.invalidate(key)
 
-        # Parse [inp] using pinYin Tree
-        for j, parsed in enumerate([self.user_tree.walk_through(inp),
-                                    self.tree.walk_through(inp)]):
-            # parsed = self.tree.walk_through(inp)
-            frame = self.frame
-            if j == 0:
-                frame = self.user_frame
+    def output(self, fetched, return_json=False, return_frame=True):
+        # Convert the CheckoutResult [fetched] into the required type
+        if return_json:
+            return fetched.to_json()
+        if return_frame:
+            if len(fetched) == 0:
+                # No records found
+                return '{}'
+            return fetched.to_frame()
+        return fetched
 
+    def convert(self, inp, n_best=5, return_json=False):
+        # Convert the whole [inp] into [n_best] sentences,
+        # the list of [sentence, score] will be returned,
+        # it will be converted into json type if [return_json] is set to True
+        from .sentence import SentenceConverter
+        if self.converter is None:
+            self.converter = SentenceConverter(self)
+
+        t = time.perf_counter()
+        converted = self.converter.convert(inp, n_best=n_best)
+        size = len(converted)
+        if return_json:
+            converted = dumps(converted)
+
+        self.observe('convert', inp, t, size)
+        return converted
+
+    def session(self):
+        # New session for incremental checkout,
+        # use one session for every input buffer
+        return CheckoutSession(self)
+
+    def lookup(self, inp):
+        # Lookup [inp] in every source,
+        # return the rows of the CheckoutResult
+        return self.collect(self.founds(inp))
+
+    def founds(self, inp, path=None):
+        # Walk the index using [inp] only once,
+        # return the found dict of every source, see path_founds,
+        # the [path] is the known walk of the [inp]
+        if path is None:
+            path = walk_path(self.index, inp)
+        return [path_founds(self.index, inp, path, source)
+                for source in range(len(self.layers))]
+
+    def collect(self, founds, stop=None):
+        # Collect the rows of the CheckoutResult,
+        # [founds] are the founds of every source,
+        # the collection stops once there are [stop] rows
+        rows = []
+
+        for source in self.order:
+            if stop is not None and len(rows) >= stop:
+                break
+            parsed = founds[source]
+            candidates = self.layers[source]
             for key in sorted(parsed, reverse=True):
                 prefix, remain = parsed[key]
                 if len(prefix) == 0:
                     continue
-                full = f'{key}\'{remain}'
 
                 # Find records based on [key]
-                if key not in frame.index:
+                if key not in candidates:
                     # No [key] record found
                     continue
-                found = frame.loc[key].copy()
-                found['Full'] = full
-                found['Prefix'] = prefix
-                found['Remain'] = remain
-                fetched = fetched.append(found, ignore_index=True)
-
-        if len(fetched) == 0:
-            # No records found
-            return '{}'
+                ranked = candidates[key]
+                rows.append((prefix, remain, f'{key}\'{remain}',
+                             ranked, len(ranked)))
+                if stop is not None and len(rows) >= stop:
+                    break
 
-        fetched.Candidates = fetched.Candidates.map(merge_dicts)
-        fetched['Num'] = fetched.Candidates.map(len)
-        fetched = fetched[['Prefix', 'Remain', 'Full', 'Candidates', 'Num']]
-        if return_json:
-            fetched = fetched.to_json()
-
-        logger.debug(f'Checkout {inp} used {time.time() - t} seconds')
-        return fetched
+        return rows
 
     def to_pandas(self, fetched):
         # Convert [fetched] to pandas DataFrame,
@@ -0,0 +1,160 @@
+# File: prefetcher.py
+# Package: inputMethod
+# Aim: Prefetch the checkouts of the likely next letters in the background
+
+import logging
+import os
+import sys
+import threading
+import time
+
+from .tree_walk import walk_path
+
+logger = logging.getLogger('Engine')
+
+
+class Prefetcher(object):
+    # Speculative checkouts during the think time between the keystrokes,
+    # after the checkout of inp, the checkouts of inp + c are cached,
+    # for the letters c of the [width] most frequent children of inp,
+    # the work runs in the daemon thread at low priority:
+    #   it starts after the engine is idle for [delay] seconds,
+    #   it gives way whenever the engine is in use,
+    #   it drops the plan once the next checkout comes
+    def __init__(self, engine, width=3, delay=0.05):
+        self.engine = engine
+        self.width = width
+        self.delay = delay
+
+        # The key of the latest checkout to be planned,
+        # and the time of the latest checkout
+        self.latest = None
+        self.touched = time.time()
+
+        # The keys prefetched and not yet checked out
+        self.prefetched = set()
+        self.requests = 0
+        self.hits = 0
+        self.fetches = 0
+
+        self.go = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='Prefetcher',
+                                       daemon=True)
+        self.thread.start()
+
+    def schedule(self, key):
+        # Plan the prefetch after the checkout of [key]
+        with self.condition:
+            self.latest = key
+            self.touched = time.time()
+            self.condition.notify()
+
+    def count(self, key):
+        # Count the checkout of [key] before it is looked up in the cache,
+        # it is called with the engine locked
+        self.requests += 1
+        if key in self.prefetched:
+            self.prefetched.discard(key)
+            if key in self.engine.cache:
+                self.hits += 1
+
+    def next_keys(self, key):
+        # The keys of the likely next letters after [key],
+        # the children are ranked by their most frequent pinYins
+        inp, *options = key
+        index = self.engine.index
+        path = walk_path(index, inp)
+        if len(path) < len(inp) + 1:
+            # The index can not move forward
+            return []
+        children = sorted(index.children(path[-1]),
+                          key=lambda e: index.weight(e[1]), reverse=True)
+        return [(inp + c, *options) for c, _ in children[:self.width]]
+
+    def idle(self):
+        # Wait until the engine is idle for [delay] seconds,
+        # return False if the plan is dropped
+        with self.condition:
+            while True:
+                if not self.go or self.latest is not None:
+                    return False
+                wait = self.touched + self.delay - time.time()
+                if wait <= 0:
+                    return True
+                self.condition.wait(wait)
+
+    def acquire(self):
+        # Lock the engine once it is idle,
+        # the lock is never waited for, so the checkouts are not delayed,
+        # return False if the plan is dropped
+        while True:
+            if not self.idle():
+                return False
+            if self.engine.lock.acquire(blocking=False):
+                return True
+            # The engine is in use, wait for another idle period
+            with self.condition:
+                self.touched = time.time()
+
+    def prefetch(self, key):
+        # Prefetch the next keys of [key] one by one,
+        # the engine is locked only for one step at a time,
+        # and only when it is idle, see acquire
+        lock = self.engine.lock
+        if not self.acquire():
+            return
+        try:
+            keys = self.next_keys(key)
+        finally:
+            lock.release()
+
+        for nxt in keys:
+            if not self.acquire():
+                return
+            try:
+                if nxt not in self.engine.cache:
+                    self.engine.fill(nxt)
+                    self.prefetched.add(nxt)
+                    self.fetches += 1
+            finally:
+                lock.release()
+            # Give way to the other threads
+            time.sleep(0)
+
+    def run(self):
+        if sys.platform.startswith('linux'):
+            # The nice value is per thread on Linux
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError:
+                logger.warning('Can not lower the priority of the prefetcher')
+
+        while True:
+            with self.condition:
+                while self.go and self.latest is None:
+                    self.condition.wait()
+                if not self.go:
+                    return
+                key = self.latest
+                self.latest = None
+            self.prefetch(key)
+
+    def stop(self):
+        # Stop the thread
+        with self.condition:
+            self.go = False
+            self.condition.notify()
+        self.thread.join()
+
+    def stats(self):
+        # Counters of the prefetcher,
+        # the hit rate is the ratio of the checkouts served by the prefetch,
+        # the precision is the ratio of the prefetches being used
+        return dict(
+            requests=self.requests,
+            hits=self.hits,
+            fetches=self.fetches,
+            hit_rate=self.hits / self.requests if self.requests else 0.0,
+            precision=self.hits / self.fetches if self.fetches else 0.0,
+        )
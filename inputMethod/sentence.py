@@ -0,0 +1,101 @@
+# File: sentence.py
+# Package: inputMethod
+# Aim: Convert the whole pinYin sentence into chinese characters
+
+import heapq
+import math
+import time
+
+from .pinYin_engine import SYSTEM, merge_ranked
+
+
+class SentenceConverter(object):
+    # Convert the whole [inp] using the lattice of the known pinYins,
+    # every edge of the lattice is a known pinYin of inp[i:j],
+    # with its most frequent candidates,
+    # the best paths are found by the beam search (n-best Viterbi),
+    # the score of a path is the sum of log(count / total) of the words,
+    # so the longer words with less segments are preferred.
+    def __init__(self, engine, beam=8, width=3, time_budget=0.05):
+        # [beam] is the number of the paths kept at every position,
+        # [width] is the number of the candidates used for every pinYin,
+        # [time_budget] is the seconds allowed for a conversion,
+        # the beam and width reduce to 1 when it is exceeded
+        self.engine = engine
+        self.beam = beam
+        self.width = width
+        self.time_budget = time_budget
+
+    def edges(self, inp, start, width):
+        # Edges starting from [start],
+        # every edge is (end, word, count)
+        index = self.engine.index
+        layers = self.engine.layers
+        ends = dict()
+        node = index.root
+        for pos in range(start, len(inp)):
+            node = index.child(node, inp[pos])
+            if node is None:
+                break
+            if not index.is_end(node):
+                continue
+            key = inp[start:pos + 1]
+            for source in self.engine.order:
+                if index.is_end(node, source) and key in layers[source]:
+                    ends.setdefault(pos + 1, []).append(layers[source][key])
+
+        edges = []
+        for end, cands in ends.items():
+            for word, count in merge_ranked(cands, width):
+                edges.append((end, word, count))
+        return edges
+
+    def convert(self, inp, n_best=5):
+        # Convert [inp] into the [n_best] sentences,
+        # return the list of [sentence, score]
+        t = time.time()
+        beam = self.beam
+        width = self.width
+        log_total = math.log(max(self.engine.index.total(SYSTEM), 1))
+        # Score of the unknown letter,
+        # it is worse than any known word
+        unknown = -2 * log_total
+
+        # Paths ending at every position,
+        # every path is (score, words)
+        paths = [[] for _ in range(len(inp) + 1)]
+        paths[0] = [(0.0, ())]
+        for start in range(len(inp)):
+            if not paths[start]:
+                continue
+
+            if time.time() - t > self.time_budget:
+                # Out of time, only the best path goes on
+                beam = 1
+                width = 1
+            paths[start] = heapq.nlargest(beam, paths[start])
+
+            if inp[start] == '\'':
+                # The separator costs nothing
+                edges = [(start + 1, '', 0)]
+            else:
+                edges = [(end, word, math.log(max(count, 1)) - log_total)
+                         for end, word, count in self.edges(inp, start, width)]
+                if not edges:
+                    # Keep the unknown letter as it is
+                    edges = [(start + 1, inp[start], unknown)]
+
+            for score, words in paths[start]:
+                for end, word, cost in edges:
+                    paths[end].append((score + cost, words + (word,)))
+
+        # Merge the paths of the same sentence
+        sentences = dict()
+        for score, words in paths[-1]:
+            sentence = ''.join(words)
+            if sentence not in sentences or sentences[sentence] < score:
+                sentences[sentence] = score
+
+        return [[sentence, score]
+                for sentence, score in heapq.nlargest(
+                    n_best, sentences.items(), key=lambda x: x[1])]
@@ -0,0 +1,54 @@
+# File: tree_walk.py
+# Package: inputMethod
+# Aim: Provide the walk shared by the pinYin trees of every backend
+
+# Max number of the sources in a tree,
+# the sources of a node are stored in bit mask of one byte
+MAX_SOURCES = 8
+
+
+def walk_path(tree, track):
+    # Walk the [tree] using the [track],
+    # return the nodes passed by the walk, starting from the root,
+    # the path stops where the tree can not move forward
+    path = [tree.root]
+    for c in track:
+        node = tree.child(path[-1], c)
+        if node is None:
+            break
+        path.append(node)
+    return path
+
+
+def path_founds(tree, track, path, source=0):
+    # Found dict of the [source] from the [path] of the [track],
+    # it is the same as walking the tree having only the pinYins of the source,
+    # so one walk serves every source.
+    # Every found value is fixed structure: [mainbody, remain],
+    # mainbody is the matched or guessed string prefix,
+    #          if the mainbody is guessed, it will end with "..."
+    # remain is the remaining of the mainbody
+    founds = dict()
+
+    # The source can not move forward where it has no pinYins
+    depth = len(path) - 1
+    while depth > 0 and not tree.has_source(path[depth], source):
+        depth -= 1
+
+    for pos in range(min(depth + 1, len(track))):
+        if tree.is_end(path[pos], source):
+            # Find known pinYin
+            founds[track[:pos]] = [track[:pos], track[pos:]]
+
+    node = path[depth]
+    if depth == len(track):
+        founds[track] = [track, '']
+    elif depth == 0 or tree.is_end(node, source):
+        # Can not move forward
+        return founds
+
+    if not tree.is_end(node, source):
+        for guessed in tree.top_ends(node, source):
+            founds[guessed] = ['{}...'.format(track[:depth]), track[depth:]]
+
+    return founds
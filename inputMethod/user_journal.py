@@ -0,0 +1,117 @@
+# File: user_journal.py
+# Package: inputMethod
+# Aim: Provide append-only journal of the user learning
+
+import json
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger('Engine')
+
+
+class UserJournal(object):
+    # Append-only journal of the user learning,
+    # the first line is the json of {"id": id} naming the journal,
+    # every other line is the json of [pinYin, ciZu],
+    # the lines are flushed on every append,
+    # and synced to the disk in batches,
+    # the journal is replaced by an empty one with the new id
+    # after its records are compacted into the snapshot,
+    # the snapshot records the id and the number of the compacted records,
+    # so they are skipped if the journal is not replaced yet, see skipped
+    def __init__(self, path, sync_every=16, sync_interval=1.0):
+        # [sync_every] is the max number of the records not synced,
+        # [sync_interval] is the max seconds of the records not synced
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        # The journal without the id line is written by the older versions
+        self.id = None
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            self.create()
+        self.records = sum(1 for _ in self.replay())
+        self.pending = 0
+        self.synced = time.time()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __len__(self):
+        # Number of the records in the journal
+        return self.records
+
+    def create(self):
+        # Replace the journal by an empty one with the new id,
+        # the new one is synced before it replaces the old one
+        self.id = uuid.uuid4().hex
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(dict(id=self.id)) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def skipped(self, compacted):
+        # Number of the records to skip in replaying,
+        # [compacted] is the [id, number] of the journal in the snapshot,
+        # the records are compacted already if the journal is the same
+        if compacted is None:
+            return 0
+        journal_id, num = compacted
+        if journal_id == self.id:
+            return num
+        return 0
+
+    def replay(self, skip=0):
+        # Yield the (pinYin, ciZu) records in the journal,
+        # the first [skip] records are skipped,
+        # the broken line written by an interrupted append is ignored
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if isinstance(record, dict):
+                        self.id = record['id']
+                        continue
+                    pinYin, ciZu = record
+                except (ValueError, KeyError):
+                    logger.warning(f'Ignore broken journal line: {line!r}')
+                    continue
+                if skip > 0:
+                    skip -= 1
+                    continue
+                yield pinYin, ciZu
+
+    def append(self, pinYin, ciZu):
+        # Append the record of [pinYin] and [ciZu]
+        self.file.write(json.dumps([pinYin, ciZu]) + '\n')
+        self.file.flush()
+        self.records += 1
+        self.pending += 1
+        if any([self.pending >= self.sync_every,
+                time.time() - self.synced >= self.sync_interval]):
+            self.sync()
+
+    def sync(self):
+        # Sync the appended records to the disk
+        if self.pending > 0:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.pending = 0
+        self.synced = time.time()
+
+    def clear(self):
+        # Empty the journal,
+        # it is called after the records are saved in the snapshot
+        self.file.close()
+        self.create()
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.records = 0
+        self.pending = 0
+        self.synced = time.time()
+
+    def close(self):
+        self.sync()
+        self.file.close()
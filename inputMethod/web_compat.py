@@ -4,28 +4,90 @@
 import json
 import threading
 import urllib
-from . import _cellDict_path
+from . import _cellDict_path, _compiled_path
+from .compiled_dict import dict_path
 from .pinYin_engine import PinYinEngine
 
 
 class Worker(object):
-    def __init__(self):
-        self.engine = PinYinEngine(_cellDict_path)
+    def __init__(self, prefetch_width=0):
+        # Prefer the compiled dict, it loads much faster,
+        # unless it is older than the merged.json
+        # [prefetch_width] enables the prefetch of the next letters,
+        # see PinYinEngine
+        path = dict_path(_compiled_path, _cellDict_path)
+        self.engine = PinYinEngine(path, prefetch_width=prefetch_width)
+        # Checkout sessions of the clients
+        self.sessions = dict()
+
+    def session(self, client):
+        # Get the checkout session of the [client]
+        if client not in self.sessions:
+            self.sessions[client] = self.engine.session()
+        return self.sessions[client]
+
+    def page(self, query):
+        # Split the [query] into the value and the paging options,
+        #   [value]&limit=[limit]&offset=[offset]&cap=[cap]
+        # the options are optional, see PinYinEngine.checkout,
+        # the option not being a non-negative integer is ignored,
+        # so its default is used
+        value, *pairs = query.split('&')
+        options = dict()
+        for pair in pairs:
+            name, _, number = pair.partition('=')
+            if (name in ('limit', 'offset', 'cap') and
+                    number.isascii() and number.isdigit()):
+                options[name] = int(number)
+        return value, options
 
     def response(self, path):
         # Received path is like this:
         #   /pinYinCheckout?query=[pinYin]
         #     [pinYin] is the pinYin of interest
+        # the checkout commands accept the paging options, see page
 
         # Checkout command
         head = 'pinYinCheckOut?query='
         if path.startswith(head):
+            pinYin, options = self.page(path[len(head):])
             # Check if is empty
-            if len(path) == len(head):
+            if len(pinYin) == 0:
                 return '{}'
             # Checkout
-            pinYin = path[len(head):]
-            return self.engine.checkout(pinYin, return_json=True)
+            return self.engine.checkout(pinYin, return_json=True, **options)
+
+        # Convert command, the whole pinYin sentence is converted
+        #   /pinYinConvert?query=[pinYin]
+        head = 'pinYinConvert?query='
+        if path.startswith(head):
+            # Check if is empty
+            if len(path) == len(head):
+                return '[]'
+            pinYin = urllib.parse.unquote(path[len(head):])
+            return self.engine.convert(pinYin, return_json=True)
+
+        # Session checkout command,
+        # the input buffer of the client is checked out incrementally
+        #   /pinYinSession?pair=[client],[pinYin]
+        head = 'pinYinSession?pair='
+        if path.startswith(head):
+            pair, options = self.page(path[len(head):])
+            pair = pair.split(',')
+            assert(len(pair) == 2)
+            client = urllib.parse.unquote(pair[0])
+            pinYin = urllib.parse.unquote(pair[1])
+            session = self.session(client)
+            # Check if is empty
+            if len(pinYin) == 0:
+                session.set(pinYin)
+                return '{}'
+            return session.checkout(pinYin, return_json=True, **options)
+
+        # Metrics command, the metrics of the engine in the text format
+        #   /metrics
+        if path == 'metrics':
+            return self.engine.metrics.render('engine_')
 
         # Update command
         head = 'pinYinUpdate?pair='
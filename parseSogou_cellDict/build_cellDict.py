@@ -0,0 +1,362 @@
+# File: build_cellDict.py
+# Aim: Build the merged.json from the cell dicts in parallel
+#
+# Every .scel file is parsed in a worker process into its own pinYin_count,
+# it is saved sorted by the pinYin, the sorted partial counts are merged
+# by adding them up in a streaming k-way merge, so the memory is bounded
+# by the number of the files instead of the size of them.
+#
+# The build is incremental, the partial counts are cached in .build/,
+# only the new or changed files are parsed,
+# and the partial counts of the removed ones are subtracted.
+#
+#   python parseSogou_cellDict/build_cellDict.py [folder] [--workers 4]
+#       [--output merged.json] [--compile] [--full]
+
+# %%
+import argparse
+import collections
+import hashlib
+import heapq
+import itertools
+import json
+import multiprocessing
+import operator
+import os
+import sys
+import time
+
+from parse_cellDict import SCEL_cellDict, SCEL_stream
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+_cellDict_dir = os.path.join(_root, 'cellDicts')
+if _root not in sys.path:
+    sys.path.append(_root)
+
+from inputMethod.encoder import dumps  # noqa: E402
+
+# The files larger than the size are streamed, see SCEL_stream,
+# it is slower, but the memory does not grow with the size of the file
+STREAM_SIZE = 32 << 20
+
+# The folder of the cache of the incremental build, in the folder of the
+# cell dicts, it has
+#   state.jsonl: the manifest of the built files in the first line,
+#                {"manifest": {name: {hash, size, mtime_ns}}},
+#                then the merged counts and their references,
+#                see merge_entries,
+#   [hash].jsonl: the partial pinYin_count of the file of the hash.
+# The .jsonl files have one pinYin in every line, sorted by the pinYin,
+# so they are merged by streaming them instead of loading them.
+# The manifest and the counts are replaced together in one file,
+# so they never disagree.
+BUILD_DIR = '.build'
+
+
+def parse_partial(path):
+    # Parse the .scel file in [path] into its own pinYin_count,
+    #   {pinYin: [count, {ciZu: count}]}
+    # the pinYins without any ciZu are dropped
+    if os.path.getsize(path) > STREAM_SIZE:
+        with SCEL_stream(path) as stream:
+            pinYin_count = stream.read_ciZu()
+    else:
+        celldict = SCEL_cellDict(path, dict())
+        celldict.pipeline()
+        pinYin_count = celldict.pinYin_count
+    return {pinYin: found for pinYin, found in pinYin_count.items()
+            if found[1]}
+
+
+def save_partial(pair):
+    # Parse the .scel file and save its partial pinYin_count,
+    # [pair] is (path of the .scel file, path of the partial),
+    # every line is [pinYin, count, {ciZu: count}], sorted by the pinYin,
+    # return the [pair]
+    path, partial_path = pair
+    partial = parse_partial(path)
+    write_lines(([pinYin] + partial[pinYin] for pinYin in sorted(partial)),
+                partial_path)
+    return pair
+
+
+def save_partials(pairs, workers=None):
+    # Parse and save the partials of the (path, partial_path) [pairs],
+    # yield the pairs as soon as they are saved,
+    # [workers] is the number of the worker processes,
+    # None refers the number of cpus, 0 parses them in this process
+    if workers == 0 or len(pairs) < 2:
+        yield from map(save_partial, pairs)
+        return
+
+    workers = min(workers or os.cpu_count() or 1, len(pairs))
+    with multiprocessing.Pool(workers) as pool:
+        # The larger files go first to balance the workers
+        pairs = sorted(pairs, key=lambda e: os.path.getsize(e[0]),
+                       reverse=True)
+        yield from pool.imap_unordered(save_partial, pairs)
+
+
+# %%
+def write_lines(entries, path):
+    # Write the [entries] into the .jsonl file in [path], one in every line,
+    # it replaces the old one only when it is complete
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False,
+                               separators=(',', ':')))
+            f.write('\n')
+    os.replace(tmp_path, path)
+
+
+def read_lines(path):
+    # Yield the entries of the .jsonl file in [path]
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def load_manifest(state_path):
+    # The manifest in the first line of the state in [state_path],
+    # None if the state is missing or has no manifest,
+    # like the state of the older builds
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            return json.loads(f.readline())['manifest']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def read_state(state_path):
+    # Yield the entries of the state in [state_path],
+    # the manifest in the first line is skipped
+    entries = read_lines(state_path)
+    next(entries, None)
+    yield from entries
+
+
+def signed(entries, sign):
+    # The partial [entries] as the entries of the state,
+    # their counts and references are multiplied by [sign],
+    # see merge_entries
+    for pinYin, count, ciZus in entries:
+        yield [pinYin, sign * count, sign,
+               {ciZu: [sign * num, sign] for ciZu, num in ciZus.items()}]
+
+
+def merge_entries(streams):
+    # Merge the sorted [streams] of the state entries,
+    #   [pinYin, count, refs, {ciZu: [count, refs]}],
+    # the refs are the number of the files having the pinYin or the ciZu,
+    # the counts and the refs of the same pinYin are added up,
+    # the pinYins and ciZus without refs are dropped,
+    # yield the merged entries sorted by the pinYin,
+    # only the entries of one pinYin are held at a time
+    merged = heapq.merge(*streams, key=operator.itemgetter(0))
+    for pinYin, entries in itertools.groupby(merged,
+                                             key=operator.itemgetter(0)):
+        _, count, refs, ciZus = next(entries)
+        for _, num, num_refs, others in entries:
+            count += num
+            refs += num_refs
+            for ciZu, (num, num_refs) in others.items():
+                found = ciZus.get(ciZu)
+                if found is None:
+                    ciZus[ciZu] = [num, num_refs]
+                else:
+                    found[0] += num
+                    found[1] += num_refs
+        if refs == 0:
+            continue
+        yield [pinYin, count, refs,
+               {ciZu: found for ciZu, found in sorted(ciZus.items())
+                if found[1] != 0}]
+
+
+def write_merged(entries, path):
+    # Write the merged.json of the state [entries] into [path],
+    # [entries] is the function returning the iterator of the entries,
+    # it is called twice, for the Count and the Candidates,
+    # the pinYins without any ciZu are dropped,
+    # it replaces the old one only when it is complete
+    #   {"Count":{pinYin:count},"Candidates":{pinYin:{ciZu:count}}}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('{"Count":{')
+        sep = ''
+        for pinYin, count, _, ciZus in entries():
+            if ciZus:
+                f.write(f'{sep}{dumps(pinYin)}:{count}')
+                sep = ','
+        f.write('},"Candidates":{')
+        sep = ''
+        for pinYin, _, _, ciZus in entries():
+            if ciZus:
+                ciZus = {ciZu: found[0] for ciZu, found in ciZus.items()}
+                f.write(f'{sep}{dumps(pinYin)}:{dumps(ciZus)}')
+                sep = ','
+        f.write('}}')
+    os.replace(tmp_path, path)
+
+
+# %%
+def file_hash(path):
+    # The sha256 of the content of the file in [path]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def incremental_build(folder, output, workers=None, full=False):
+    # Build the .scel files in the [folder] into the merged.json in [output]
+    # incrementally,
+    # the files are compared with the manifest by their hashes,
+    # the removed or changed ones are subtracted from the state,
+    # the new or changed ones are parsed and added into the state,
+    # nothing is done if no file is changed,
+    # [full] rebuilds the state and parses every file,
+    # see save_partials for the [workers]
+    build_dir = os.path.join(folder, BUILD_DIR)
+    os.makedirs(build_dir, exist_ok=True)
+    state_path = os.path.join(build_dir, 'state.jsonl')
+
+    def partial_path(digest):
+        # The path of the cached partial of the [digest]
+        return os.path.join(build_dir, digest + '.jsonl')
+
+    # The state without the manifest is rebuilt
+    manifest = None if full else load_manifest(state_path)
+    if manifest is None:
+        manifest = dict()
+
+    # The hashes of the files, the unchanged size and mtime reuse the hash
+    paths = dict()
+    new_manifest = dict()
+    for path in scel_paths(folder):
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        found = manifest.get(name)
+        if (found is not None and found['size'] == stat.st_size and
+                found['mtime_ns'] == stat.st_mtime_ns):
+            digest = found['hash']
+        else:
+            digest = file_hash(path)
+        new_manifest[name] = dict(hash=digest,
+                                  size=stat.st_size,
+                                  mtime_ns=stat.st_mtime_ns)
+        paths[digest] = path
+
+    # The hashes are counted, the same file in two names counts twice
+    old_hashes = collections.Counter(e['hash'] for e in manifest.values())
+    new_hashes = collections.Counter(e['hash']
+                                     for e in new_manifest.values())
+
+    if (old_hashes == new_hashes and manifest == new_manifest and
+            os.path.isfile(output)):
+        print('Nothing is changed')
+        return
+
+    # The removed ones can not be subtracted without their partials,
+    # the state is rebuilt from the partials then
+    streams = []
+    if manifest and all(os.path.isfile(partial_path(e))
+                        for e in old_hashes):
+        streams.append(read_state(state_path))
+    else:
+        old_hashes = collections.Counter()
+    removed = old_hashes - new_hashes
+    added = new_hashes - old_hashes
+
+    missing = [(paths[e], partial_path(e)) for e in added
+               if full or not os.path.isfile(partial_path(e))]
+    for _ in save_partials(missing, workers):
+        pass
+
+    # The state is merged with the partials of the removed and the added
+    for digest, times in removed.items():
+        streams.append(signed(read_lines(partial_path(digest)), -times))
+    for digest, times in added.items():
+        streams.append(signed(read_lines(partial_path(digest)), times))
+    new_state_path = state_path + '.new'
+    write_lines(itertools.chain([dict(manifest=new_manifest)],
+                                merge_entries(streams)),
+                new_state_path)
+
+    # The output is replaced before the state,
+    # if the build is interrupted between them,
+    # the next build applies the same changes to the old state again
+    write_merged(lambda: read_state(new_state_path), output)
+    os.replace(new_state_path, state_path)
+
+    # The compiled merged.bin is stale once the merged.json is rewritten,
+    # it is removed rather than loaded, use --compile to compile it again
+    compiled_path = os.path.splitext(output)[0] + '.bin'
+    if os.path.isfile(compiled_path):
+        os.remove(compiled_path)
+        print(f'Removed the stale {compiled_path}')
+
+    # The partials of the files no longer built are dropped,
+    # with the .json partials, state and manifest of the older builds
+    for name in os.listdir(build_dir):
+        digest, ext = os.path.splitext(name)
+        if ((ext == '.jsonl' and len(digest) == 64 and
+                digest not in new_hashes) or
+                (ext == '.json' and len(digest) == 64) or
+                name in ('state.json', 'manifest.json')):
+            os.remove(os.path.join(build_dir, name))
+
+    print(f'Parsed {len(missing)}, added {sum(added.values())} '
+          f'and removed {sum(removed.values())} cell dicts')
+
+
+def compile_merged(path, compiled_path):
+    # Compile the merged.json in [path], see inputMethod/compiled_dict.py
+    import pandas as pd
+    from inputMethod.compiled_dict import compile_dict
+    compile_dict(pd.read_json(path), compiled_path)
+
+
+def scel_paths(folder):
+    # The .scel files in the [folder]
+    return sorted(os.path.join(folder, name)
+                  for name in os.listdir(folder)
+                  if name.endswith('.scel'))
+
+
+# %%
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Build the merged.json from the .scel files.')
+    parser.add_argument('folder', nargs='?', default=_cellDict_dir,
+                        help='The folder of the .scel files')
+    parser.add_argument('--workers', type=int,
+                        help='The number of the worker processes, '
+                             'default is the number of cpus, '
+                             '0 parses in this process')
+    parser.add_argument('-o', '--output',
+                        help='The merged.json, default is in the folder')
+    parser.add_argument('--compile', action='store_true',
+                        help='Compile the merged.json into merged.bin')
+    parser.add_argument('--full', action='store_true',
+                        help='Parse every file instead of the changed ones')
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.join(args.folder, 'merged.json')
+
+    t = time.time()
+    incremental_build(args.folder, output, args.workers, args.full)
+    print(f'Built the cell dicts into {output}, '
+          f'used {time.time() - t:.2f} seconds')
+
+    if args.compile:
+        compiled_path = os.path.splitext(output)[0] + '.bin'
+        compile_merged(output, compiled_path)
+        print(f'Compiled {output} into {compiled_path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
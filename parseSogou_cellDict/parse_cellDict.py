@@ -1,16 +1,15 @@
 # File: parse_cellDict.py
 # Aim: Parse cell dict.
+# The cell dicts are built into merged.json by build_cellDict.py
 
 # %%
-import json
-import os
-import pandas as pd
-import struct
-import time
+import gc
+import mmap
+import numpy as np
 
 
 class SCEL_cellDict(object):
-    def __init__(self, filepath, pinYin_count=dict()):
+    def __init__(self, filepath, pinYin_count=None):
         self.init_settings()
 
         with open(filepath, 'rb') as f:
@@ -20,9 +19,22 @@ class SCEL_cellDict(object):
 
         self.filepath = filepath
 
+        # The rawdata as the 2 bytes units,
+        # the units are read by index instead of unpacked one by one,
+        # the odd tail byte is never read
+        size = len(self.rawdata) >> 1
+        self.units = memoryview(self.rawdata)[:size * 2].cast(self.format)
+
+        # The rawdata as the string of one char for every unit,
+        # it is decoded at once, and the strings are sliced from it
+        self.text = np.frombuffer(self.rawdata, dtype='<u2', count=size)\
+            .astype('<u4').tobytes().decode('utf-32-le', 'surrogatepass')
+
         # !!! pinYin_count is essential,
         # users can use existing pinYin_count to warn startup,
         # default is using empty pinYin_count as cold startup.
+        if pinYin_count is None:
+            pinYin_count = dict()
         self.pinYin_count = pinYin_count
 
     def init_settings(self):
@@ -34,34 +46,26 @@ class SCEL_cellDict(object):
         self.format = 'H'
 
     def _forward(self, step=2):
-        # Read self.rawdata,
-        # Read the next [step] bytes and return the unpacked bytes
+        # Read the next [step] bytes,
+        # return the unsigned short if [step] is 2,
+        # or the list of the unsigned shorts
 
         # The [step] value should be even
         assert (step % 2 == 0)
 
-        # Read one pair of bytes
-        if step == 2:
-            self.pos += step
-            return struct.unpack(self.format,
-                                 self.rawdata[self.pos - 2:self.pos])[0]
-
-        # Read several pair of bytes
-        grouped_each_pairBytes = [
-            self.rawdata[self.pos + i * 2:self.pos + i * 2 + 2]
-            for i in range(step >> 1)
-        ]
+        start = self.pos >> 1
         self.pos += step
-        return [
-            struct.unpack(self.format, e)[0] for e in grouped_each_pairBytes
-        ]
-
-    def _str(self, lst):
-        # Convert lst into string
-        if not isinstance(lst, type([])):
-            lst = [lst]
-        string = ''.join([chr(e) for e in lst])
-        string = string.replace('\x00', '')
+        if step == 2:
+            return self.units[start]
+        return self.units[start:self.pos >> 1].tolist()
+
+    def _str(self, length):
+        # Read the next [length] bytes as string
+        start = self.pos >> 1
+        self.pos += length
+        string = self.text[start:self.pos >> 1]
+        if '\x00' in string:
+            string = string.replace('\x00', '')
         return string
 
     def pipeline(self):
@@ -94,10 +98,10 @@ class SCEL_cellDict(object):
         self.pos = 0x130
 
         # Read infos in order
-        self.Name = self._str(self._forward(0x330 - self.pos))
-        self.Type = self._str(self._forward(0x540 - self.pos))
-        self.Description = self._str(self._forward(0xd40 - self.pos))
-        self.Example = self._str(self._forward(self.pinYin_offset - self.pos))
+        self.Name = self._str(0x330 - self.pos)
+        self.Type = self._str(0x540 - self.pos)
+        self.Description = self._str(0xd40 - self.pos)
+        self.Example = self._str(self.pinYin_offset - self.pos)
 
     def read_pinYin_table(self):
         # Read pinYin table of the .scel file
@@ -120,9 +124,7 @@ class SCEL_cellDict(object):
             # length of pinYin bytes
             length = self._forward()
             # pinYin
-            pinYin = self._str(self._forward(length))
-            # pinYin = self.byte2str(self.rawdata[self.pos:self.pos+length])
-            # self.pos += length
+            pinYin = self._str(length)
             # Record
             self.pinYin_table[idx] = pinYin
             self.pinYin_count[pinYin] = [0, dict()]
@@ -142,103 +144,211 @@ class SCEL_cellDict(object):
         # each word is three elements tuple: (count, pinYin, ciZu)
         self.words = []
 
+        # The words and counts are plenty of small containers,
+        # the garbage collector is paused while they are created,
+        # since there is no cycle in them
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._read_ciZu()
+        finally:
+            if enabled:
+                gc.enable()
+
+        return self.words
+
+    def _read_ciZu(self):
         # Read until reach the end of the file
         # Structure is (num x 2, length x 2, pinYin_idxs x length, wordarea x num),
         # structure of wordarea is (length x 2, word x length, length x 2, extend x length) repeat num times,
         # structure of extend is (count x 2, ???)
-        while self.pos < len(self.rawdata):
+        # The loop works on the units and the text directly,
+        # the position is the index of the unit in the loop
+        units = self.units
+        text = self.text
+        pinYin_count = self.pinYin_count
+        # The pinYins of every idx, the missing ones are '--'
+        pinYins = ['--'] * (1 << 16)
+        for idx, pinYin in self.pinYin_table.items():
+            pinYins[idx] = pinYin
+        get_pinYin = pinYins.__getitem__
+        append = self.words.append
+        pos = self.ciZu_offset >> 1
+        end = len(units)
+        while pos < end:
             # count of ciZu with the same pinYin
-            num = self._forward()
+            num = units[pos]
             # length of pinYin bytes
-            length = self._forward()
+            length = units[pos + 1] >> 1
             # pinYin
-            pinYin_idxs = self._forward(length)
-            pinYin = '\''.join([self.get_pinYin(idx) for idx in pinYin_idxs])
+            pys = list(map(get_pinYin,
+                           units[pos + 2:pos + 2 + length].tolist()))
+            pos += 2 + length
+            if num == 0:
+                continue
+            pinYin = '\''.join(pys)
+
+            # Add pinYin into pinYin_count
+            _pinYin = ''.join(pys)
+            if _pinYin not in pinYin_count:
+                pinYin_count[_pinYin] = [0, dict()]
+            found = pinYin_count[_pinYin]
+            # The counts of the pinYin of every char, see below
+            chars_found = [pinYin_count[py] for py in pys]
 
             # Read the ciZu words
             for _ in range(num):
                 # length of the word bytes
-                length = self._forward()
+                length = units[pos] >> 1
                 # word
-                word = self._str(self._forward(length))
-                # length of extend bytes
-                length = self._forward()
+                word = text[pos + 1:pos + 1 + length]
+                if '\x00' in word:
+                    word = word.replace('\x00', '')
+                pos += 1 + length
+                # length of extend bytes,
                 # word count is in the first 2 bytes of extend
-                extend = self._forward(length)
-                count = extend[0]
+                count = units[pos + 1]
+                pos += 1 + (units[pos] >> 1)
                 # Record
-                self.words.append((count, pinYin, word))
+                append((count, pinYin, word))
 
-                # Add pinYin into pinYin_count
-                _pinYin = pinYin.replace('\'', '')
-                if _pinYin not in self.pinYin_count:
-                    self.pinYin_count[_pinYin] = [0, dict()]
-                self.pinYin_count[_pinYin][0] += count
-                self.pinYin_count[_pinYin][1][word] = count
+                found[0] += count
+                found[1][word] = count
 
                 # Split single char,
                 # !!! char here means chinese character not pinYin letter,
                 # and add single char pinYin into pinYin_count
-                for py, char in zip(pinYin.split('\''), word):
-                    self.pinYin_count[py][0] += count
+                for char_found, char in zip(chars_found, word):
+                    char_found[0] += count
                     # Frequency count of single char,
                     # it will be very large,
                     # compare to pinYin of a ciZu
-                    if char not in self.pinYin_count[py][1]:
-                        self.pinYin_count[py][1][char] = 0
-                    self.pinYin_count[py][1][char] += count
-
-        return self.words
-
+                    chars = char_found[1]
+                    chars[char] = chars.get(char, 0) + count
+
+        self.pos = pos << 1
+
+
+def add_word(pinYin_count, count, pinYin, word):
+    # Add the ciZu [word] of the [pinYin] and its chars into [pinYin_count],
+    # it is the same as SCEL_cellDict.read_ciZu for one word
+    pys = pinYin.split('\'')
+
+    # Add pinYin into pinYin_count
+    _pinYin = ''.join(pys)
+    if _pinYin not in pinYin_count:
+        pinYin_count[_pinYin] = [0, dict()]
+    pinYin_count[_pinYin][0] += count
+    pinYin_count[_pinYin][1][word] = count
+
+    # Split single char,
+    # !!! char here means chinese character not pinYin letter,
+    # and add single char pinYin into pinYin_count
+    for py, char in zip(pys, word):
+        pinYin_count[py][0] += count
+        # Frequency count of single char,
+        # it will be very large,
+        # compare to pinYin of a ciZu
+        if char not in pinYin_count[py][1]:
+            pinYin_count[py][1][char] = 0
+        pinYin_count[py][1][char] += count
+
+
+class SCEL_stream(SCEL_cellDict):
+    # Streaming reader of the .scel file,
+    # the file is mapped into memory instead of read,
+    # and the ciZus are yielded one by one as they are decoded,
+    # so the raw bytes and the words are never held at the same time
+    #
+    #   with SCEL_stream(filepath) as stream:
+    #       for count, pinYin, word in stream:
+    #           ...
+    def __init__(self, filepath, pinYin_count=None):
+        self.init_settings()
 
-# %%
-# File settings
-if True:
-    folder = os.path.join(os.path.dirname(__file__), '..', 'cellDicts')
-
-    for name in os.listdir(folder):
-        if not name.endswith('.scel'):
-            continue
-        print(name)
-        celldict = SCEL_cellDict(os.path.join(folder, name))
-        celldict.pipeline()
-        celldict.solid_pinYin_count()
+        self.file = open(filepath, 'rb')
+        self.rawdata = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        self.view = memoryview(self.rawdata)
 
-# %%
+        if not self.legal_check():
+            self.close()
+            raise AssertionError(f'Illegal .scel file: {filepath}')
 
-folder = os.path.join(os.path.dirname(__file__), '..', 'cellDicts')
-frames = [pd.read_json(os.path.join(folder, name))
-          for name in os.listdir(folder)
-          if all([name.startswith('_'),
-                  name.endswith('json')])]
+        self.filepath = filepath
 
-frames
+        # The rawdata as the 2 bytes units, the odd tail byte is never read
+        size = len(self.rawdata) >> 1
+        self.units = self.view[:size * 2].cast(self.format)
 
-# %%
-merged_frame = pd.concat(frames, axis=1)
-merged_frame.Candidates = merged_frame.Candidates.fillna({})
-merged_frame.Count = merged_frame.Count.fillna(0)
-merged_frame['Count'] = [e for e in merged_frame.pop('Count').values]
-merged_frame['Candidates'] = [e for e in merged_frame.pop('Candidates').values]
+        if pinYin_count is None:
+            pinYin_count = dict()
+        self.pinYin_count = pinYin_count
 
-merged_frame.Count = merged_frame.Count.map(lambda x: int(sum(x)))
+        # The info and the pinYin table are small, they are read at once
+        self.read_info()
+        self.read_pinYin_table()
 
+    def _str(self, length):
+        # Read the next [length] bytes as string,
+        # only the bytes of the string are decoded
+        start = self.pos >> 1
+        self.pos += length
+        string = ''.join(map(chr, self.units[start:self.pos >> 1]))
+        if '\x00' in string:
+            string = string.replace('\x00', '')
+        return string
 
-def merge_dicts(dicts):
-    merged = dict()
-    for dct in dicts:
-        if not isinstance(dct, dict):
-            continue
-        for key, value in dct.items():
-            if key in merged:
-                merged[key] += value
-            else:
-                merged[key] = value
-    return merged
+    def pipeline(self):
+        # Pipeline of reading the bytes,
+        # the info and the pinYin table are read on the initialization
+        self.read_ciZu()
 
+    def __iter__(self):
+        # Yield (count, pinYin, ciZu) of every word, see read_ciZu
+        self.pos = self.ciZu_offset
+        end = len(self.units) << 1
+        while self.pos < end:
+            # count of ciZu with the same pinYin
+            num = self._forward()
+            # length of pinYin bytes
+            length = self._forward()
+            # pinYin, the idxs are copied into the list,
+            # so no view of the map is held across the yield
+            pinYin_idxs = self.units[self.pos >> 1:
+                                     (self.pos + length) >> 1].tolist()
+            self.pos += length
+            pinYin = '\''.join([self.get_pinYin(idx) for idx in pinYin_idxs])
 
-merged_frame.Candidates = merged_frame.Candidates.map(merge_dicts)
-merged_frame.to_json(os.path.join(folder, 'merged.json'))
-merged_frame
+            # Read the ciZu words
+            for _ in range(num):
+                # length of the word bytes
+                length = self._forward()
+                # word
+                word = self._str(length)
+                # length of extend bytes,
+                # word count is in the first 2 bytes of extend
+                length = self._forward()
+                count = self.units[self.pos >> 1]
+                self.pos += length
+                yield count, pinYin, word
 
-# %%
+    def read_ciZu(self):
+        # Read ciZu in the .scel file into pinYin_count,
+        # the words are counted as they are read instead of kept
+        for count, pinYin, word in self:
+            add_word(self.pinYin_count, count, pinYin, word)
+        return self.pinYin_count
+
+    def close(self):
+        # Unmap and close the file
+        self.units = None
+        self.view.release()
+        self.rawdata.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()